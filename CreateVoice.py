@@ -1,55 +1,103 @@
 import os
-from pydub import AudioSegment
+import wave
 import requests
 from dotenv import load_dotenv
+from pcm_cache import decode_all, PCM_CHANNELS, PCM_SAMPLE_WIDTH, PCM_FRAME_RATE
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Merge audio files with 2 seconds silence in between and return the path of the merged file
-def merge_audio_files(files, target_file):
-    combined = AudioSegment.empty()
-    silence = AudioSegment.silent(duration=500)  # 0.5 seconds of silence
-    max_size_bytes = 10 * 1024 * 1024  # 10MB
-    num_files = 0
-
-    for file in files:
-        print(f"Processing file: {file}")  # Print the file being processed
-        audio = AudioSegment.from_file(file)
-
-        # Split large audio files into chunks of max size
-        while len(audio) > 0:
-            chunk = audio[:max_size_bytes]
-            audio = audio[max_size_bytes:]
-            
-            temp = combined + chunk + silence
-            temp.export(target_file, format='wav')
-            
-            if os.path.getsize(target_file) > max_size_bytes:
-                if num_files == 0:  # If the first chunk is too big, skip it
-                    num_files = 1
-                else:
-                    os.remove(target_file)  # Delete the oversized file
-                break  # If adding this chunk would exceed the max size, stop here
-            
-            combined = temp
-            num_files += 1
-
-        if num_files > 0:  # Only export the file if at least one chunk was added
-            combined.export(target_file, format='wav')
-        else:
-            target_file = None
-
-    return target_file, num_files
-
-
-
-
-
-
-def create_voice(directory_path, voice_name, voice_description, labels):
-    url = "https://api.elevenlabs.io/v1/voices/add"
-    api_key = os.getenv("ELEVENLABS_API_KEY")
+WAV_HEADER_BYTES = 44  # Size of the header the wave module writes for plain PCM
+
+
+class WavPacker:
+    """
+    Packs clips into WAV files of at most max_bytes each, with silence between clips. The size of a
+    PCM WAV is known from its frame count, so each output is written exactly once as clips arrive.
+    A clip that doesn't fit in the current file starts the next one; only clips longer than a whole
+    file are split.
+    """
+
+    def __init__(self, target_pattern, max_files, max_bytes, silence_ms, channels=PCM_CHANNELS, sample_width=PCM_SAMPLE_WIDTH, frame_rate=PCM_FRAME_RATE):
+        self.target_pattern = target_pattern
+        self.max_files = max_files
+        self.params = (channels, sample_width, frame_rate)
+        self.frame_bytes = channels * sample_width
+        self.max_frames = (max_bytes - WAV_HEADER_BYTES) // self.frame_bytes
+        self.silence = b'\0' * (frame_rate * silence_ms // 1000 * self.frame_bytes)
+        self.paths = []
+        self.output = None
+        self.frames_written = 0
+
+    def open_next(self):
+        self.close()
+        if len(self.paths) >= self.max_files:
+            return False
+        path = self.target_pattern.format(len(self.paths))
+        self.output = wave.open(path, 'wb')
+        self.output.setnchannels(self.params[0])
+        self.output.setsampwidth(self.params[1])
+        self.output.setframerate(self.params[2])
+        self.paths.append(path)
+        self.frames_written = 0
+        return True
+
+    def write(self, data):
+        self.output.writeframes(data)
+        self.frames_written += len(data) // self.frame_bytes
+
+    # Add one clip of raw PCM in the packer's format, followed by silence. Returns False once all the files are full.
+    def add(self, data):
+        # A memoryview lets a mapped clip be written out in pieces without copying it
+        data = memoryview(data)
+        clip_frames = len(data) // self.frame_bytes
+        if self.output is None or (self.frames_written + clip_frames > self.max_frames and clip_frames <= self.max_frames):
+            if not self.open_next():
+                return False
+        while data:
+            room = (self.max_frames - self.frames_written) * self.frame_bytes
+            if room <= 0:
+                if not self.open_next():
+                    return False
+                continue
+            self.write(data[:room])
+            data = data[room:]
+        # The silence is cut short rather than pushing the file over max_bytes
+        room = (self.max_frames - self.frames_written) * self.frame_bytes
+        self.write(self.silence[:room])
+        return True
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
+# Merge audio files with half a second of silence in between into at most max_files WAV files of at most max_bytes each.
+# The files are decoded on a process pool into the PCM cache, so a second run over the same recordings decodes nothing,
+# and each merged file is written once. Returns the paths of the merged files.
+def merge_audio_files(files, target_pattern, cache_dir, max_files=25, max_bytes=10 * 1024 * 1024, silence_ms=500, workers=None):
+    packer = WavPacker(target_pattern, max_files, max_bytes, silence_ms)
+    decoded = decode_all(files, cache_dir, workers)
+    try:
+        for file, pcm in decoded:
+            print(f"Processing file: {file}")  # Print the file being processed
+            added = packer.add(pcm)
+            if hasattr(pcm, 'close'):
+                pcm.close()
+            if not added:
+                print(f"Reached {max_files} merged files of {max_bytes} bytes, skipping the remaining recordings")
+                break
+    finally:
+        decoded.close()
+        packer.close()
+    return packer.paths
+
+
+def create_voice(directory_path, voice_name, voice_description, labels, url="https://api.elevenlabs.io/v1/voices/add", api_key=None, cache_dir=os.path.join('.cache', 'pcm'), workers=None):
+    if api_key is None:
+        # The variable may hold a comma-separated list of keys; the first one is used
+        api_key = (os.getenv("ELEVENLABS_API_KEY") or '').split(',')[0].strip()
 
     headers = {
         "Accept": "application/json",
@@ -64,16 +112,15 @@ def create_voice(directory_path, voice_name, voice_description, labels):
     # Get all audio files in directory and sort them
     files = sorted([os.path.join(directory_path, f) for f in os.listdir(directory_path) if f.lower().endswith(('.mp3', '.wav'))])
 
-    max_files = 25
-    voice_files = []
-    start = 0
-    while start < len(files) and len(voice_files) < max_files:
-        merged_file_path, num_files = merge_audio_files(files[start:], f'{directory_path}/merged_{len(voice_files)}.wav')
-        if merged_file_path is not None:
-            voice_files.append(('files', (os.path.basename(merged_file_path), open(merged_file_path, 'rb'), 'audio/mpeg')))
-        start += num_files
+    # ElevenLabs takes at most 25 samples of at most 10MB each
+    merged_paths = merge_audio_files(files, os.path.join(directory_path, 'merged_{}.wav'), cache_dir, workers=workers)
+    voice_files = [('files', (os.path.basename(path), open(path, 'rb'), 'audio/mpeg')) for path in merged_paths]
 
-    response = requests.post(url, headers=headers, data=data, files=voice_files)
+    try:
+        response = requests.post(url, headers=headers, data=data, files=voice_files)
+    finally:
+        for _, (_, f, _) in voice_files:
+            f.close()
     print(response.text)
 
 
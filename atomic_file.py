@@ -0,0 +1,29 @@
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Yield the path of a temp file next to `path` for the caller to write, then rename it into place.
+    If the write fails the temp file is removed, so an interrupted write never leaves a half written
+    file at `path` or a stray .part file next to it.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.part')
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+
+# Open a temp file next to `path` for writing; it replaces `path` once the block finishes without an error
+@contextlib.contextmanager
+def atomic_write(path, mode='w', encoding=None):
+    with atomic_path(path) as temp_path:
+        with open(temp_path, mode, encoding=encoding) as f:
+            yield f
@@ -0,0 +1,292 @@
+# Local stand-ins for the ElevenLabs, Play.ht and OpenAI endpoints used by main.py and CreateVoice.py.
+# One threaded HTTP server answers all three under different path prefixes:
+#
+#   /elevenlabs/v1/voices                   voice catalog (with ETag revalidation)
+#   /elevenlabs/v1/text-to-speech/<voice>   streamed audio
+#   /elevenlabs/v1/voices/add               voice cloning upload
+#   /elevenlabs/v1/user/subscription        character quota of the key
+#   /playht/api/v1/getVoices                voice catalog
+#   /playht/api/v1/convert                  returns a transcriptionId
+#   /playht/api/v1/articleStatus            converted after ready_delay, one audio URL per line
+#   /playht/audio/<id>/<n>.mp3              audio download, labelled with the voice and text of line n
+#   /openai/v1/chat/completions             casting reply ranking the first voices in the prompt
+#
+# Generated audio is a WAV file of noise between stretches of silence; ElevenLabs takes get louder with stability.
+# Latency, payload size, 429/5xx injection and Play.ht readiness delay are configurable.
+# Any key works except "revoked", which gets a 401 from every ElevenLabs and Play.ht endpoint, and "throttled" and
+# "expired", which can read the catalogs but get a 429 and a 401 on every generation request.
+import io
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+DEFAULT_OPTIONS = {
+    'voices': 20,            # Voices in each provider's catalog
+    'latency': 0.05,         # Seconds before the first byte of a generation response
+    'jitter': 0.02,          # Extra random latency, up to this many seconds
+    'payload_bytes': 32768,  # Size of each generated audio file
+    'error_rate': 0.0,       # Share of generation requests answered with a 429 or 503
+    'ready_delay': 0.5,      # Seconds before a Play.ht conversion is ready
+    'character_limit': 1000000,  # Characters in each ElevenLabs subscription
+    'seed': 0
+}
+
+
+# A 16-bit mono WAV of about `size` bytes: noise in the middle with a quarter of silence on either side,
+# so the post-processing stage has something to trim and normalize
+def mock_audio(size, rng, amplitude=3000, frame_rate=22050):
+    frames = max(0, size - 44) // 2
+    edge = frames // 4
+    noise = b''.join(rng.randint(-amplitude, amplitude).to_bytes(2, 'little', signed=True) for _ in range(frames - 2 * edge))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(b'\0\0' * edge + noise + b'\0\0' * edge)
+    return buffer.getvalue()
+
+
+# Add a chunk naming what the audio was generated from to a WAV file. Players skip chunks they don't know,
+# so it sounds the same, but a check can tell whether a file holds the line it was saved for.
+def label_audio(audio, label):
+    data = label.encode('utf-8')
+    chunk = b'mock' + struct.pack('<I', len(data)) + data + b'\0' * (len(data) % 2)
+    return audio[:4] + struct.pack('<I', len(audio) + len(chunk) - 8) + audio[8:] + chunk
+
+
+# The label added by label_audio, or None
+def audio_label(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, size = data[position:position + 4], struct.unpack('<I', data[position + 4:position + 8])[0]
+        if chunk_id == b'mock':
+            return data[position + 8:position + 8 + size].decode('utf-8')
+        position += 8 + size + size % 2
+    return None
+
+
+def playht_label(voice, text):
+    return f"{voice}: {text}"
+
+
+def mock_voices(count):
+    genders = ['male', 'female']
+    accents = ['american', 'british', 'australian', 'irish']
+    return [{'name': f'Voice {i}', 'gender': genders[i % 2], 'accent': accents[i % len(accents)]} for i in range(count)]
+
+
+class MockState:
+    def __init__(self, options):
+        self.options = dict(DEFAULT_OPTIONS, **options)
+        self.random = random.Random(self.options['seed'])
+        self.lock = threading.Lock()
+        self.conversions = {}
+        self.requests = {}
+        self.voices = mock_voices(self.options['voices'])
+        self.audio = mock_audio(self.options['payload_bytes'], self.random)
+        self.audio_by_stability = {}
+
+    # ElevenLabs takes get louder with the stability setting, so a settings sweep has something to tell apart
+    def elevenlabs_audio(self, stability):
+        with self.lock:
+            if stability not in self.audio_by_stability:
+                amplitude = int(1000 + 8000 * min(max(stability, 0.0), 1.0))
+                self.audio_by_stability[stability] = mock_audio(self.options['payload_bytes'], self.random, amplitude)
+            return self.audio_by_stability[stability]
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def inject_error(self):
+        with self.lock:
+            if self.random.random() >= self.options['error_rate']:
+                return None
+            return self.random.choice([429, 503])
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.options['jitter'])
+        time.sleep(self.options['latency'] + jitter)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_audio(self, content_type='audio/mpeg', audio=None):
+        audio = audio or self.state.audio
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(audio)))
+        self.end_headers()
+        # Stream in chunks like the real APIs do
+        for start in range(0, len(audio), 16384):
+            self.wfile.write(audio[start:start + 16384])
+
+    def send_rejected_key(self):
+        if 'revoked' not in (self.headers.get('xi-api-key'), self.headers.get('Authorization')):
+            return False
+        self.send_json({'detail': {'status': 'invalid_api_key'}}, status=401)
+        return True
+
+    def send_refused_generation(self):
+        keys = (self.headers.get('xi-api-key'), self.headers.get('Authorization'))
+        status = 429 if 'throttled' in keys else 401 if 'expired' in keys else None
+        if status is None:
+            return False
+        self.state.count('refused')
+        self.send_json({'detail': {'status': 'too_many_requests' if status == 429 else 'invalid_api_key'}}, status=status,
+                       headers={'Retry-After': '0'} if status == 429 else None)
+        return True
+
+    def send_injected_error(self):
+        status = self.state.inject_error()
+        if status is None:
+            return False
+        self.send_json({'error': 'injected failure'}, status=status, headers={'Retry-After': '0'} if status == 429 else None)
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        state = self.state
+        if self.send_rejected_key():
+            state.count('rejected')
+            return
+        if path == '/elevenlabs/v1/voices':
+            state.count('elevenlabs_voices')
+            etag = f'"catalog-{len(state.voices)}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            voices = [{'voice_id': f'el{i}', 'name': voice['name'], 'preview_url': '', 'labels': {'gender': voice['gender'], 'accent': voice['accent']}}
+                      for i, voice in enumerate(state.voices)]
+            self.send_json({'voices': voices}, headers={'ETag': etag})
+        elif path == '/elevenlabs/v1/user/subscription':
+            state.count('elevenlabs_subscription')
+            self.send_json({'character_count': 0, 'character_limit': state.options['character_limit']})
+        elif path == '/playht/api/v1/getVoices':
+            state.count('playht_voices')
+            voices = [{'value': f'ph{i}', 'name': voice['name'], 'gender': voice['gender'], 'language': 'English (US)'} for i, voice in enumerate(state.voices)]
+            self.send_json({'voices': voices})
+        elif path == '/playht/api/v1/articleStatus':
+            state.count('playht_status')
+            if self.send_injected_error():
+                return
+            transcription_id = parse_qs(url.query).get('transcriptionId', [''])[0]
+            with state.lock:
+                conversion = state.conversions.get(transcription_id)
+            if conversion is None:
+                self.send_json({'error': 'unknown transcription'}, status=404)
+            elif time.monotonic() < conversion['ready_at']:
+                self.send_json({'converted': False})
+            else:
+                base_url = f"http://{self.headers.get('Host')}/playht/audio/{transcription_id}"
+                urls = [f"{base_url}/{i}.mp3" for i in range(len(conversion['lines']))]
+                self.send_json({'converted': True, 'audioUrl': urls if len(urls) > 1 else urls[0]})
+        elif path.startswith('/playht/audio/'):
+            state.count('playht_download')
+            transcription_id, line = path[len('/playht/audio/'):].split('/')
+            with state.lock:
+                conversion = state.conversions.get(transcription_id)
+            if conversion is None:
+                self.send_json({'error': 'unknown transcription'}, status=404)
+                return
+            self.send_audio(audio=label_audio(state.audio, conversion['lines'][int(os.path.splitext(line)[0])]))
+        else:
+            self.send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        state = self.state
+        body = self.read_body()
+        if self.send_rejected_key():
+            state.count('rejected')
+            return
+        if path.startswith('/elevenlabs/v1/text-to-speech/'):
+            state.count('elevenlabs_tts')
+            if self.send_refused_generation() or self.send_injected_error():
+                return
+            state.delay()
+            stability = json.loads(body).get('voice_settings', {}).get('stability', 0.5)
+            self.send_audio(audio=state.elevenlabs_audio(stability))
+        elif path == '/elevenlabs/v1/voices/add':
+            state.count('elevenlabs_add_voice')
+            state.delay()
+            self.send_json({'voice_id': uuid.uuid4().hex, 'uploaded_bytes': len(body)})
+        elif path == '/playht/api/v1/convert':
+            state.count('playht_convert')
+            if self.send_refused_generation() or self.send_injected_error():
+                return
+            state.delay()
+            request = json.loads(body)
+            content, voice = request.get('content', []), request.get('voice', '')
+            transcription_id = uuid.uuid4().hex
+            with state.lock:
+                state.conversions[transcription_id] = {'lines': [playht_label(voice, text) for text in content], 'ready_at': time.monotonic() + state.options['ready_delay']}
+            self.send_json({'status': 'CREATED', 'transcriptionId': transcription_id})
+        elif path == '/openai/v1/chat/completions':
+            state.count('openai_chat')
+            if self.send_injected_error():
+                return
+            state.delay()
+            prompt = json.loads(body)['messages'][-1]['content']
+            wanted = int(re.search(r"Return the top (\d+)", prompt).group(1))
+            names = re.findall(r"(?:: |, )([\w ]+?) \(gender", prompt)[:wanted]
+            reply = '\n'.join(f"{i + 1}. {name} - a good fit" for i, name in enumerate(names))
+            self.send_json({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(reply) // 4}})
+        else:
+            self.send_json({'error': 'not found'}, status=404)
+
+
+# Start the mock server on a free local port in a background thread. Returns the server and its base URL.
+def start_mock_server(options=None):
+    state = MockState(options or {})
+    handler = type('BoundMockHandler', (MockHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == "__main__":
+    server, base_url = start_mock_server()
+    print(f"Mock ElevenLabs, Play.ht and OpenAI APIs listening on {base_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
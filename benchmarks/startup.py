@@ -0,0 +1,64 @@
+# Measure cold start time of the CLI for commands that should not touch the network:
+# list-voices with a warm catalog cache and generate --dry-run with a cached cast.
+# Usage: python benchmarks/startup.py [runs]
+import configparser
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from catalog_cache import save_catalog
+
+BENCHMARK_API_KEY = 'benchmark-key'
+
+
+def write_settings(work_dir):
+    # Start from the repo settings and point everything that writes or reads files at the work directory
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_DIR, 'settings.ini'))
+    config.set('System', 'directory_name', os.path.join(work_dir, 'output'))
+    config.set('Voice', 'use_elevenlabs', 'true')
+    config.set('Voice', 'use_playht', 'false')
+    config.set('Voice', 'specified_voices_elevenlabs', 'benchmark voice')
+    config.set('Settings', 'lines_file', os.path.join(REPO_DIR, 'lines.csv'))
+    config.set('Settings', 'elevenlabs_actors', '0')
+    if not config.has_section('Cache'):
+        config.add_section('Cache')
+    config.set('Cache', 'directory', os.path.join(work_dir, 'cache'))
+    path = os.path.join(work_dir, 'settings.ini')
+    with open(path, 'w') as f:
+        config.write(f)
+
+    # Seed the catalog cache so no command needs the network
+    voices = [{'voice_id': f'voice{i}', 'name': 'benchmark voice' if i == 0 else f'voice {i}', 'preview_url': '', 'labels': {'gender': 'female', 'accent': 'american'}} for i in range(200)]
+    save_catalog(config.get('Cache', 'directory'), 'elevenlabs', BENCHMARK_API_KEY, voices)
+    return path
+
+
+def time_command(settings_path, command, runs):
+    env = dict(os.environ, ELEVENLABS_API_KEY=BENCHMARK_API_KEY)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, 'main.py'), '--settings', settings_path] + command,
+                       cwd=REPO_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as work_dir:
+        settings_path = write_settings(work_dir)
+        for command in (['list-voices'], ['generate', '--dry-run']):
+            timings = time_command(settings_path, command, runs)
+            print(f"{' '.join(command):<20} median {statistics.median(timings) * 1000:7.1f} ms   min {min(timings) * 1000:7.1f} ms   max {max(timings) * 1000:7.1f} ms   ({runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# End-to-end throughput benchmark against the local mock APIs in mock_servers.py.
+# Runs `main.py generate` (and optionally `main.py clone`) in a subprocess pointed at the mock server
+# and reports jobs/sec, p50/p99 job latency, peak RSS, bytes written and the requests the server saw.
+# Play.ht runs also check that every file holds the audio of its own line, as labelled by the mock server.
+#
+# Usage: python benchmarks/throughput.py --provider elevenlabs --lines 50 --concurrency 8 --error-rate 0.05
+import argparse
+import configparser
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from metrics import percentile
+from mock_servers import audio_label, playht_label, start_mock_server
+
+
+LINE_TEXT = 'This is benchmark line number {}, spoken with feeling.'
+
+
+def write_settings(work_dir, base_url, args):
+    # Start from the repo settings and point every URL and file at the mock server and the work directory
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_DIR, 'settings.ini'))
+    voice_names = ', '.join(f'voice {i}' for i in range(args.voices))
+    settings = {
+        'System': {'directory_name': os.path.join(work_dir, 'output'), 'concurrency': str(args.concurrency), 'retry_backoff': '0.1'},
+        'Voice': {'use_elevenlabs': 'true', 'use_playht': 'true', 'specified_voices_elevenlabs': voice_names,
+                  'specified_voices_playht': voice_names, 'listvoicesonly': 'false'},
+        'Settings': {'lines_file': os.path.join(work_dir, 'lines.csv'), 'line_id_prefix': '', 'line_range': '',
+                     'elevenlabs_actors': str(args.cast), 'playht_actors': str(args.cast), 'adaptive_sweep': str(args.adaptive_sweep).lower()},
+        'Cache': {'directory': os.path.join(work_dir, 'cache')},
+        'ElevenLabs': {'url': f'{base_url}/elevenlabs/v1/voices', 'url_tts': f'{base_url}/elevenlabs/v1/text-to-speech',
+                       'url_add_voice': f'{base_url}/elevenlabs/v1/voices/add', 'url_subscription': f'{base_url}/elevenlabs/v1/user/subscription'},
+        'PlayHT': {'url_get_voices': f'{base_url}/playht/api/v1/getVoices', 'url_convert': f'{base_url}/playht/api/v1/convert',
+                   'url_status': f'{base_url}/playht/api/v1/articleStatus', 'poll_interval': '0.2', 'batch_size': str(args.batch_size)},
+        'ChatGPT': {'url': f'{base_url}/openai/v1/chat/completions'},
+        'PostProcess': {'enabled': str(args.postprocess).lower()}
+    }
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    path = os.path.join(work_dir, 'settings.ini')
+    with open(path, 'w') as f:
+        config.write(f)
+
+    with open(os.path.join(work_dir, 'lines.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'text'])
+        for i in range(args.lines):
+            writer.writerow([f'Line_{i}', LINE_TEXT.format(i)])
+    return path
+
+
+# Run main.py in one subprocess per command, all at the same time, and return the wall time and the highest peak RSS in MB
+def run_main(settings_path, commands, args):
+    # Several comma-separated keys spread the requests over the credential pool; a revoked one gets 401s from the mock server,
+    # a throttled or expired one a 429 or 401 on every generation request
+    keys = ','.join([f'benchmark{i}' for i in range(args.keys)] + (['revoked'] if args.revoked_key else [])
+                    + (['throttled'] if args.throttled_key else []) + (['expired'] if args.expired_key else []))
+    env = dict(os.environ, ELEVENLABS_API_KEY=keys, PLAYHT_API_KEY=keys, PLAYHT_USER_ID='benchmark', CHATGPT_API_KEY='benchmark')
+    started = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'main.py'), '--settings', settings_path] + command,
+                                  cwd=REPO_DIR, env=env, stdout=None if args.verbose else subprocess.DEVNULL) for command in commands]
+    peak_rss = 0.0
+    for command, process in zip(commands, processes):
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise RuntimeError(f"main.py {' '.join(command)} failed with exit code {os.waitstatus_to_exitcode(status)}")
+        peak_rss = max(peak_rss, usage.ru_maxrss / 1024)
+    return time.perf_counter() - started, peak_rss
+
+
+# The latest record of every job across the manifests of all workers; a job done by any of them counts as done
+def read_manifest(output_dir):
+    records = {}
+    for name in sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []:
+        if not (name.startswith('manifest') and name.endswith('.jsonl')):
+            continue
+        worker_records = {}
+        with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                worker_records[record['job']] = record
+        for job, record in worker_records.items():
+            if job not in records or record['status'] == 'done':
+                records[job] = record
+    return list(records.values())
+
+
+# Play.ht takes saved with the audio of another line or voice, which a wrong batch-to-line mapping would cause
+def misplaced_playht_takes(output_dir, records, num_lines):
+    texts = {f'Line_{i}': LINE_TEXT.format(i) for i in range(num_lines)}
+    misplaced = []
+    for record in records:
+        match = re.fullmatch(r'playht_(.+)_(Line_\d+)\.mp3', record['job'])
+        if record['status'] != 'done' or match is None:
+            continue
+        if audio_label(os.path.join(output_dir, record['job'])) != playht_label(match.group(1), texts[match.group(2)]):
+            misplaced.append(record['job'])
+    return misplaced
+
+
+def benchmark_generate(server, base_url, args, provider, work_dir):
+    settings_path = write_settings(work_dir, base_url, args)
+    requests_before = dict(server.state.requests)
+    # With several workers each one gets its own shard of the jobs, like separate machines sharing the output directory
+    commands = [['generate', '--provider', provider] + (['--shard', f'{i}/{args.workers}'] if args.workers > 1 else []) + (['--leases'] if args.leases else [])
+                for i in range(1, args.workers + 1)]
+    wall_time, peak_rss = run_main(settings_path, commands, args)
+    records = read_manifest(os.path.join(work_dir, 'output'))
+    if provider == 'playht':
+        misplaced = misplaced_playht_takes(os.path.join(work_dir, 'output'), records, args.lines)
+        if misplaced:
+            raise RuntimeError(f"{len(misplaced)} Play.ht file(s) hold the audio of another line, e.g. {misplaced[0]}")
+    done = [record for record in records if record['status'] == 'done']
+    latencies = [record['latency'] for record in done if 'latency' in record]
+    return {
+        'scenario': f'generate {provider}' + (f' x{args.workers}' if args.workers > 1 else ''),
+        'jobs': len(done),
+        'failed': len([record for record in records if record['status'] == 'failed']),
+        'not_started': len([record for record in records if record['status'] == 'planned']),
+        'wall_time': wall_time,
+        'jobs_per_sec': len(done) / wall_time if wall_time else 0.0,
+        'p50_latency': percentile(latencies, 0.50),
+        'p99_latency': percentile(latencies, 0.99),
+        'peak_rss_mb': peak_rss,
+        'bytes_written': sum(record.get('bytes', 0) for record in done),
+        'server_requests': {endpoint: count - requests_before.get(endpoint, 0) for endpoint, count in server.state.requests.items()
+                            if count != requests_before.get(endpoint, 0)}
+    }
+
+
+def write_take(path, seconds, sample_rate=22050):
+    # A silent mono 16-bit take; cloning only cares about the size of the audio
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+
+
+def benchmark_clone(server, base_url, args, work_dir):
+    settings_path = write_settings(work_dir, base_url, args)
+    takes_dir = os.path.join(work_dir, 'takes')
+    os.makedirs(takes_dir)
+    for i in range(args.clone_files):
+        write_take(os.path.join(takes_dir, f'take_{i:04d}.wav'), args.clone_seconds)
+    requests_before = dict(server.state.requests)
+    wall_time, peak_rss = run_main(settings_path, [['clone', takes_dir, '--name', 'benchmark']], args)
+    merged = [name for name in os.listdir(takes_dir) if name.startswith('merged_')]
+    return {
+        'scenario': 'clone',
+        'jobs': args.clone_files,
+        'failed': 0,
+        'wall_time': wall_time,
+        'jobs_per_sec': args.clone_files / wall_time if wall_time else 0.0,
+        'p50_latency': 0.0,
+        'p99_latency': 0.0,
+        'peak_rss_mb': peak_rss,
+        'bytes_written': sum(os.path.getsize(os.path.join(takes_dir, name)) for name in merged),
+        'server_requests': {endpoint: count - requests_before.get(endpoint, 0) for endpoint, count in server.state.requests.items()
+                            if count != requests_before.get(endpoint, 0)}
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<22}{'jobs':>7}{'failed':>8}{'wall s':>9}{'jobs/s':>9}{'p50 s':>8}{'p99 s':>8}{'RSS MB':>9}{'MB out':>9}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['jobs']:>7}{result['failed']:>8}{result['wall_time']:>9.2f}{result['jobs_per_sec']:>9.1f}"
+              f"{result['p50_latency']:>8.3f}{result['p99_latency']:>8.3f}{result['peak_rss_mb']:>9.1f}{result['bytes_written'] / 1e6:>9.2f}")
+        if result.get('not_started'):
+            print(f"{'':<22}jobs left planned: {result['not_started']}")
+        print(f"{'':<22}server requests: {result['server_requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generation and cloning against local mock APIs.")
+    parser.add_argument('--provider', choices=['elevenlabs', 'playht', 'both', 'all', 'none'], default='both',
+                        help="both benchmarks each provider on its own, all runs them together in one generate")
+    parser.add_argument('--lines', type=int, default=20, help="Lines in the generated script")
+    parser.add_argument('--voices', type=int, default=2, help="Specified voices per provider")
+    parser.add_argument('--cast', type=int, default=0, help="Voices to cast through the mock ChatGPT endpoint (needs the openai package)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1, help="Play.ht lines per conversion")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock server latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Extra random latency in seconds")
+    parser.add_argument('--payload-kb', type=int, default=32, help="Size of each generated audio file")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of generation requests answered with 429/503")
+    parser.add_argument('--ready-delay', type=float, default=0.5, help="Seconds before a Play.ht conversion is ready")
+    parser.add_argument('--adaptive-sweep', action='store_true', help="Prune the ElevenLabs settings grid with pilot lines first")
+    parser.add_argument('--postprocess', action='store_true', help="Also convert, trim and normalize every take as it lands")
+    parser.add_argument('--clone-files', type=int, default=0, help="Also benchmark cloning from this many takes (needs pydub)")
+    parser.add_argument('--clone-seconds', type=float, default=5.0, help="Length of each take for the clone benchmark")
+    parser.add_argument('--keys', type=int, default=1, help="API keys per provider")
+    parser.add_argument('--revoked-key', action='store_true', help="Add a key the mock server rejects with 401")
+    parser.add_argument('--throttled-key', action='store_true', help="Add a key whose generation requests get 429 (with --keys 0, the only key)")
+    parser.add_argument('--expired-key', action='store_true', help="Add a key whose generation requests get 401 (with --keys 0, the only key)")
+    parser.add_argument('--workers', type=int, default=1, help="main.py processes splitting the run with --shard")
+    parser.add_argument('--leases', action='store_true', help="Also claim every job in the output directory")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of main.py")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server({
+        'voices': max(args.voices, 20), 'latency': args.latency, 'jitter': args.jitter, 'payload_bytes': args.payload_kb * 1024,
+        'error_rate': args.error_rate, 'ready_delay': args.ready_delay
+    })
+    providers = {'both': ['elevenlabs', 'playht'], 'none': []}.get(args.provider, [args.provider])
+    results = []
+    try:
+        for provider in providers:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results.append(benchmark_generate(server, base_url, args, provider, work_dir))
+        if args.clone_files:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results.append(benchmark_clone(server, base_url, args, work_dir))
+    finally:
+        server.shutdown()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
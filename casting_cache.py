@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from atomic_file import atomic_write
+
+
+def casting_dir(cache_dir):
+    return os.path.join(cache_dir, 'casting')
+
+
+# Hash everything that can change the casting decision: the catalog the model sees, the casting note,
+# how many voices were asked for and which model was asked
+def casting_key(provider, voices, casting_note, num_suggestions, model):
+    payload = json.dumps({
+        'provider': provider,
+        'voices': voices,
+        'casting_note': casting_note,
+        'num_suggestions': num_suggestions,
+        'model': model
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Return the cached voices in their ranked order, or None on a miss. Voices are stored by id_field
+# and looked up in the current catalog so callers get the same full voice dicts as on a fresh pick.
+def load_casting(cache_dir, key, voices, id_field):
+    path = os.path.join(casting_dir(cache_dir), f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        print("Casting cache miss")
+        return None
+    voices_by_id = {voice[id_field]: voice for voice in voices}
+    print(f"Casting cache hit, reusing the cast picked at {time.ctime(entry['created_at'])}")
+    return [voices_by_id[voice_id] for voice_id in entry['voice_ids'] if voice_id in voices_by_id]
+
+
+def save_casting(cache_dir, key, top_voices, id_field, response_message):
+    entry = {
+        'voice_ids': [voice[id_field] for voice in top_voices],
+        'response': response_message,
+        'created_at': time.time()
+    }
+    directory = casting_dir(cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    with atomic_write(os.path.join(directory, f"{key}.json"), encoding='utf-8') as f:
+        json.dump(entry, f)
+
+
+# Forget every cached casting decision so the next run asks the model again
+def clear_casting_cache(cache_dir):
+    shutil.rmtree(casting_dir(cache_dir), ignore_errors=True)
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import time
+
+from atomic_file import atomic_write
+
+
+# Fingerprint an API key so catalogs from different accounts never mix, without writing the key to disk
+def key_fingerprint(api_key):
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def catalog_path(cache_dir, provider, api_key):
+    return os.path.join(cache_dir, f"catalog_{provider}_{key_fingerprint(api_key)}.json")
+
+
+# Load the cached catalog entry for this provider and account, or None if there is none yet
+def load_catalog(cache_dir, provider, api_key):
+    path = catalog_path(cache_dir, provider, api_key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def catalog_is_fresh(entry, ttl):
+    return entry is not None and time.time() - entry['fetched_at'] < ttl
+
+
+# Conditional request headers so the API can answer 304 Not Modified instead of resending the catalog
+def revalidation_headers(entry):
+    headers = {}
+    if entry is None:
+        return headers
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+# Save the catalog along with the validators from the response. Written to a temp file and renamed
+# so an interrupted run never leaves a half written cache behind.
+def save_catalog(cache_dir, provider, api_key, voices, response=None, entry=None):
+    if entry is None:
+        entry = {
+            'provider': provider,
+            'voices': voices,
+            'etag': response.headers.get('ETag') if response is not None else None,
+            'last_modified': response.headers.get('Last-Modified') if response is not None else None
+        }
+    entry['fetched_at'] = time.time()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_write(catalog_path(cache_dir, provider, api_key), encoding='utf-8') as f:
+        json.dump(entry, f)
+    return entry
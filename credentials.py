@@ -0,0 +1,166 @@
+import threading
+import time
+
+from planner import BudgetExhausted
+
+
+# Statuses that count against a credential: rejected (401) or rate limited (429)
+REJECTED_STATUS_CODES = {401, 429}
+
+
+class NoCredentialAvailable(BudgetExhausted):
+    # Every credential that can use the voice is out of quota. Like a spent budget, the job is
+    # left as planned in the manifest for the next run.
+    pass
+
+
+class CredentialRejected(Exception):
+    # The API rejected or rate limited the credential; the request can be tried again with another one
+    pass
+
+
+class CredentialsRejected(Exception):
+    # Every credential that can use the voice rejected or rate limited the request, or is out of rotation.
+    # The job failed; unlike a spent budget this is recorded as a failure.
+    pass
+
+
+class CredentialsRejecting(Exception):
+    # A job was not started because every credential is out of rotation for good (see CredentialPool.rejecting).
+    # Like a spent budget, it is left as planned in the manifest for the next run.
+    pass
+
+
+class Credential:
+    def __init__(self, name, headers, account, max_characters=0):
+        self.name = name            # Label shown in the output, never the key itself
+        self.headers = headers      # Authentication headers for the provider's API
+        self.account = account      # Key material for the catalog cache fingerprint
+        self.max_characters = max_characters  # Characters left on the account when the run started, 0 if unknown
+        self.characters_used = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.latency = None         # Moving average of the request latency in seconds
+        self.failures = 0           # 401/429 responses in a row
+        self.disabled = None        # Why the credential was taken out of rotation for good
+        self.benched_until = 0.0    # Rate limited credentials sit out until this time.monotonic()
+
+    @property
+    def remaining(self):
+        return None if not self.max_characters else max(0, self.max_characters - self.characters_used)
+
+
+class CredentialPool:
+    """
+    The API keys of one provider. Each request goes to the active key with the most quota left,
+    weighted by how fast it has been answering and how busy it is, among the keys whose account has
+    the voice (cloned voices only exist on the account that made them). A key is taken out of
+    rotation after max_failures 401 or 429 responses in a row: for good when the key is rejected,
+    for `cooldown` seconds when it is rate limited. The last key in rotation is never benched for
+    rate limiting; its requests just keep backing off as with a single key.
+    """
+
+    def __init__(self, provider, credentials, max_failures=3, cooldown=60.0):
+        self.provider = provider
+        self.credentials = credentials
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        # Voice -> names of the credentials whose catalog has it. Voices missing here can use any credential.
+        self.voice_accounts = {}
+        self.lock = threading.Lock()
+
+    def add_voices(self, credential, voices):
+        with self.lock:
+            for voice in voices:
+                self.voice_accounts.setdefault(voice, set()).add(credential.name)
+
+    def active(self):
+        now = time.monotonic()
+        return [credential for credential in self.credentials if not credential.disabled and credential.benched_until <= now]
+
+    # True once every key still in use is out of quota. Keys out of rotation for good are `rejecting`, not out of quota.
+    @property
+    def exhausted(self):
+        in_use = [credential for credential in self.credentials if not credential.disabled]
+        return bool(in_use) and not any(credential.remaining is None or credential.remaining > 0 for credential in in_use)
+
+    # True once every key is out of rotation for good after repeated 401s. Starting more jobs would only fail
+    # each of them, so callers stop until a later run. Rate limited keys come back, so they never count here.
+    @property
+    def rejecting(self):
+        return all(credential.disabled for credential in self.credentials)
+
+    def rejections(self):
+        return ', '.join(f"{credential.name}: {credential.disabled}" for credential in self.credentials if credential.disabled)
+
+    def score(self, credential, default_latency):
+        quota = 1.0 if credential.remaining is None else credential.remaining / credential.max_characters
+        return quota / ((credential.latency or default_latency) * (credential.in_flight + 1))
+
+    # Pick a credential for a request about `voice` that sends `characters`, and count them against it.
+    # While the only keys left are rate limited, wait for the first one to come back.
+    def acquire(self, voice=None, characters=0, exclude=()):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                accounts = self.voice_accounts.get(voice)
+                allowed = [credential for credential in self.credentials
+                           if not credential.disabled and credential.name not in exclude and (accounts is None or credential.name in accounts)]
+                usable = [credential for credential in allowed if credential.benched_until <= now]
+                candidates = [credential for credential in usable if credential.remaining is None or credential.remaining >= characters]
+                if candidates:
+                    return self.take(candidates, characters)
+                benched = [credential.benched_until for credential in allowed if credential.benched_until > now]
+                if not benched:
+                    # Only a key that could take the request but for its quota makes this a spent budget
+                    if usable:
+                        raise NoCredentialAvailable(f"No {self.provider} credential has {characters} characters left for voice {voice}")
+                    raise CredentialsRejected(f"No {self.provider} credential left for voice {voice}")
+                delay = min(benched) - now
+            time.sleep(delay)
+
+    # Called with the lock held
+    def take(self, candidates, characters):
+        latencies = [credential.latency for credential in self.credentials if credential.latency is not None]
+        default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+        credential = max(candidates, key=lambda candidate: self.score(candidate, default_latency))
+        credential.in_flight += 1
+        credential.requests += 1
+        credential.characters_used += characters
+        return credential
+
+    def release(self, credential, latency=None, refund=0):
+        with self.lock:
+            credential.in_flight -= 1
+            credential.characters_used -= refund
+            if latency is not None:
+                credential.latency = latency if credential.latency is None else 0.8 * credential.latency + 0.2 * latency
+
+    # Count a response against the credential. Returns False once the credential is out of rotation.
+    def report(self, credential, status):
+        with self.lock:
+            if status not in REJECTED_STATUS_CODES:
+                credential.failures = 0
+                return True
+            credential.failures += 1
+            if credential.failures < self.max_failures or credential.disabled:
+                return not credential.disabled
+            if status == 401:
+                credential.disabled = f"{credential.failures} responses with status 401 in a row"
+                print(f"Took {self.provider} {credential.name} out of rotation after {credential.disabled}")
+                return False
+            if len(self.active()) > 1:
+                credential.failures = 0
+                credential.benched_until = time.monotonic() + self.cooldown
+                print(f"{self.provider} {credential.name} is rate limited, taking it out of rotation for {self.cooldown:.0f}s")
+                return False
+            return True
+
+    def print_stats(self, name):
+        if len(self.credentials) < 2:
+            return
+        for credential in self.credentials:
+            latency = f"{credential.latency:.2f}s" if credential.latency is not None else "n/a"
+            quota = f", {credential.remaining} characters left" if credential.remaining is not None else ""
+            state = f", out of rotation ({credential.disabled})" if credential.disabled else ""
+            print(f"{name} {credential.name}: {credential.requests} requests, {credential.characters_used} characters, average latency {latency}{quota}{state}")
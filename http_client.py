@@ -0,0 +1,55 @@
+import threading
+
+
+# Sessions shared by every call to the same provider, created on first use
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# Create a session with a keep-alive connection pool so repeated calls to the same API reuse
+# their TCP+TLS connection instead of paying a new handshake on every request
+def create_session(pool_size):
+    # requests is imported here so commands that never touch the network don't pay for the import
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # The pool is sized to the provider's worker threads, so connections are reused. It does not block:
+    # requests has no pool timeout, so a connection that is never given back would hang every other thread.
+    # A thread that finds the pool empty opens a throwaway connection instead.
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(name, pool_size):
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = create_session(pool_size)
+        return _sessions[name]
+
+
+# Count the requests sent and the connections opened per host. When keep-alive works the
+# number of connections stays close to the pool size no matter how many requests were sent.
+def connection_stats(session):
+    stats = {}
+    for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            host_stats = stats.setdefault(host, {'requests': 0, 'connections': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+    return stats
+
+
+def print_connection_stats(name, session):
+    if session is None:
+        return
+    for host, host_stats in connection_stats(session).items():
+        reused = host_stats['requests'] - host_stats['connections']
+        print(f"{name} connections to {host}: {host_stats['requests']} requests over {host_stats['connections']} connections ({max(reused, 0)} reused)")
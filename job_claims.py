@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+
+LEASE_DIR_NAME = '.leases'
+
+
+# Stable ID of a generation job from what it synthesizes: provider, voice, line, settings and variant.
+# The same job gets the same ID on every machine and in every run, whatever order the jobs are walked in.
+def job_id(*parts):
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+
+# "i/n" -> (i, n), the i-th of n shards counting from 1. An empty value means no sharding.
+def parse_shard(value):
+    value = (value or '').strip()
+    if not value:
+        return None
+    match = re.fullmatch(r'(\d+)\s*/\s*(\d+)', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"invalid shard {value!r}, expected i/n with 1 <= i <= n")
+    return int(match.group(1)), int(match.group(2))
+
+
+# The name a worker's manifest and metrics files are suffixed with. An empty value means the host name.
+def parse_worker_id(value):
+    value = (value or '').strip()
+    if value and not re.fullmatch(r'[\w.-]+', value):
+        raise ValueError(f"invalid worker id {value!r}, use letters, digits, '.', '-' and '_'")
+    return value or None
+
+
+class LeaseDirectory:
+    """
+    Claims on jobs shared through a directory every worker can see, such as the output directory on a
+    shared volume. A claim is a file created exclusively, so only one worker gets it. The worker renews
+    the files it holds every ttl/3 seconds; a file not renewed for `ttl` seconds belongs to a worker that
+    crashed, and is broken by renaming it away, so only one of the workers waiting for it takes it over.
+    `worker` stays the same from run to run (the host name unless given); the claim files hold it with the
+    process ID and a random token, so a worker can tell whether a claim it made is still its own.
+    Ages are measured against the volume's clock, never the local one, so clock skew between machines
+    doesn't make live claims look stale.
+    """
+
+    def __init__(self, directory, ttl=60.0, worker=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.worker = worker or socket.gethostname()
+        self.token = uuid.uuid4().hex[:12]
+        self.owner = f"{self.worker} {os.getpid()} {self.token}"
+        self.clock_path = os.path.join(directory, f".clock.{self.worker}-{self.token}")
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+        self.taken_over = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    # The current time on the volume: the modification time of a file touched just now
+    def now(self):
+        with open(self.clock_path, 'a'):
+            pass
+        os.utime(self.clock_path)
+        return os.path.getmtime(self.clock_path)
+
+    def is_stale(self, path):
+        try:
+            modified = os.path.getmtime(path)
+        except FileNotFoundError:
+            return True
+        return self.now() - modified > self.ttl
+
+    def owns(self, path):
+        try:
+            with open(path) as f:
+                return f.read() == self.owner
+        except FileNotFoundError:
+            return False
+
+    def claim(self, key):
+        path = self.path(key)
+        with self.lock:
+            if key in self.held:
+                if self.owns(path):
+                    return True
+                # Another worker broke the lease while this one was not renewing it
+                self.held.discard(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.is_stale(path) or not self.break_lease(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.owner)
+            with self.lock:
+                self.held.add(key)
+                if self.heartbeat is None:
+                    self.heartbeat = threading.Thread(target=self.renew, daemon=True)
+                    self.heartbeat.start()
+            return True
+        return False
+
+    def break_lease(self, path):
+        stale_path = f"{path}.{self.worker}-{self.token}.stale"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            # Another worker broke it first; try to create it again
+            return True
+        if not self.is_stale(stale_path):
+            # The lease was renewed or taken over between the check and the rename; put it back
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        with self.lock:
+            self.taken_over += 1
+        return True
+
+    def release(self, key):
+        with self.lock:
+            if key not in self.held:
+                return
+            self.held.discard(key)
+        # Only remove the file while it is still this worker's, not one another worker took over
+        if self.owns(self.path(key)):
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def renew(self):
+        while not self.stopped.wait(self.ttl / 3):
+            with self.lock:
+                held = list(self.held)
+            for key in held:
+                try:
+                    with open(self.path(key)) as f:
+                        if f.read() == self.owner:
+                            # Touch the file that was read, not whatever is at the path by now
+                            os.utime(f.fileno())
+                            continue
+                except FileNotFoundError:
+                    pass
+                # The lease was broken; stop renewing it and let the job's owner be the worker that took it over
+                with self.lock:
+                    self.held.discard(key)
+
+    def close(self):
+        self.stopped.set()
+        for key in list(self.held):
+            self.release(key)
+        try:
+            os.remove(self.clock_path)
+        except FileNotFoundError:
+            pass
+
+
+class JobClaims:
+    """
+    Decides which jobs this worker runs when several workers generate into the same output directory.
+    With a shard (i, n) the worker only walks the jobs whose ID falls in its shard, which splits the run
+    without any coordination. With leases every job is claimed before it runs, so workers given the same
+    jobs never generate one twice, and the jobs of a worker that crashed are picked up once its leases expire.
+    Without either, every job is this worker's, as in a single-machine run.
+    """
+
+    def __init__(self, shard=None, leases=None):
+        self.shard = shard
+        self.leases = leases
+
+    # Manifest and metrics files get this suffix, so workers sharing the directory don't write over each other.
+    # It doesn't change between runs of a worker, so a resumed run appends to and compacts the same files.
+    @property
+    def suffix(self):
+        if self.shard is not None:
+            return f".shard-{self.shard[0]}-of-{self.shard[1]}"
+        if self.leases is not None:
+            return f".{self.leases.worker}"
+        return ''
+
+    # The same leases without the shard, for work every worker needs the results of
+    def unsharded(self):
+        return JobClaims(leases=self.leases)
+
+    # The same shard without the leases, for jobs that are claimed later, right before they run
+    def unleased(self):
+        return JobClaims(shard=self.shard)
+
+    def in_shard(self, job):
+        return self.shard is None or int(job['job_id'], 16) % self.shard[1] == self.shard[0] - 1
+
+    # 'run' once the job is this worker's (or already was), 'done' if another worker already saved its audio, 'busy' while another worker holds it
+    def claim(self, job):
+        if self.leases is None:
+            return 'run'
+        if os.path.exists(job['filename']):
+            return 'done'
+        if not self.leases.claim(job['job_id']):
+            return 'busy'
+        # The other worker may have finished and released it between the two checks
+        if os.path.exists(job['filename']):
+            self.leases.release(job['job_id'])
+            return 'done'
+        return 'run'
+
+    # Called when a job is saved, failed or left for a later run
+    def release(self, job):
+        if self.leases is not None:
+            self.leases.release(job['job_id'])
+
+    # Seconds between checks on jobs other workers hold; a check is only a stat or two per job
+    @property
+    def poll_interval(self):
+        return min(1.0, self.leases.ttl / 10) if self.leases is not None else 0.0
+
+    def close(self):
+        if self.leases is not None:
+            self.leases.close()
+            if self.leases.taken_over:
+                print(f"Took over {self.leases.taken_over} expired lease(s) from other workers")
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+
+from atomic_file import atomic_write
+
+
+MANIFEST_NAME = 'manifest.jsonl'
+AUDIO_EXTENSIONS = ('.wav', '.mp3')
+
+
+class JobManifest:
+    """
+    Append-only JSONL log of every generation job in an output directory. Each line is the latest
+    status of one job (planned, done or failed) with its attempts, bytes, latency and error, so the
+    whole directory can be resumed from a single read of this file instead of one stat per job.
+    Workers sharing the directory each append to their own manifest (`name`) and read everyone's.
+    A read_only manifest, for planning, keeps every change in memory and never writes to the directory.
+    """
+
+    def __init__(self, dir_name, name=MANIFEST_NAME, read_only=False):
+        self.path = os.path.join(dir_name, name)
+        self.read_only = read_only
+        self.jobs = {}
+        self.lock = threading.Lock()
+        others = sorted(entry.path for entry in os.scandir(dir_name) if entry.name.startswith('manifest') and entry.name.endswith('.jsonl')
+                        and entry.path != self.path) if os.path.isdir(dir_name) else []
+        for path in others:
+            self.merge(self.load(path))
+        if os.path.exists(self.path):
+            self.merge(self.load(self.path), own=True)
+        elif not others:
+            self.import_existing_files(dir_name)
+
+    def load(self, path):
+        records = {}
+        num_lines = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half written; everything before it is still good
+                    continue
+                num_lines += 1
+                records[record['job']] = record
+        # Rewrite our own log with only the latest record per job once it is mostly superseded lines
+        if path == self.path and not self.read_only and num_lines > 2 * len(records) + 1000:
+            self.compact(records)
+        return records
+
+    # A job done by any worker stays done; otherwise our own records win over the other workers'
+    def merge(self, records, own=False):
+        for job, record in records.items():
+            current = self.jobs.get(job)
+            if current is None or record['status'] == 'done' or (own and current['status'] != 'done'):
+                self.jobs[job] = record
+
+    # Directories generated before the manifest existed: treat the audio already there as done,
+    # listing the directory once instead of checking each job on its own
+    def import_existing_files(self, dir_name):
+        if not os.path.isdir(dir_name):
+            return
+        records = [{'job': entry.name, 'status': 'done', 'attempts': 0, 'bytes': entry.stat().st_size}
+                   for entry in os.scandir(dir_name) if entry.is_file() and entry.name.lower().endswith(AUDIO_EXTENSIONS)]
+        if records:
+            if not self.read_only:
+                print(f"Imported {len(records)} existing audio files into {self.path}")
+            self.append(records)
+
+    def compact(self, records):
+        with atomic_write(self.path, encoding='utf-8') as f:
+            for record in records.values():
+                f.write(json.dumps(record) + '\n')
+
+    def append(self, records):
+        with self.lock:
+            if not self.read_only:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in records))
+            for record in records:
+                self.jobs[record['job']] = record
+
+    def status(self, job):
+        record = self.jobs.get(job)
+        return record['status'] if record else None
+
+    def attempts(self, job):
+        record = self.jobs.get(job)
+        return record.get('attempts', 0) if record else 0
+
+    def is_done(self, job):
+        return self.status(job) == 'done'
+
+    # Record jobs that have not been seen before as planned, in one write
+    def plan(self, jobs):
+        records = [{'job': job, 'status': 'planned', 'attempts': 0} for job in jobs if job not in self.jobs]
+        if records:
+            self.append(records)
+
+    def record(self, job, status, bytes_written=None, latency=None, error=None, cached=False):
+        record = {'job': job, 'status': status, 'attempts': self.attempts(job) + 1, 'time': time.time()}
+        if bytes_written is not None:
+            record['bytes'] = bytes_written
+        if latency is not None:
+            record['latency'] = round(latency, 3)
+        if error is not None:
+            record['error'] = error
+        if cached:
+            record['cached'] = True
+        self.append([record])
+
+    # Average latency of the jobs that were actually generated, or None if there are none yet
+    def average_latency(self):
+        latencies = [record['latency'] for record in self.jobs.values() if 'latency' in record and not record.get('cached')]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def summary(self):
+        counts = {}
+        for record in self.jobs.values():
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
@@ -0,0 +1,76 @@
+import csv
+import json
+import os
+
+
+# Read (row number, id, text) for every line of a lines file one row at a time, so generation can start on
+# the first row without loading the whole script. Row numbers count data rows from 0; rows without text are
+# skipped. CSV, TSV and JSONL are supported; utf-8-sig strips the BOM that spreadsheet exports put in front of the header.
+def read_rows(path, stop=None):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if extension in ('.jsonl', '.ndjson'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f, delimiter='\t' if extension in ('.tsv', '.tab') else ',')
+        for row_number, row in enumerate(rows):
+            if stop is not None and row_number >= stop:
+                break
+            text = row['text']
+            if text is None or not str(text).strip():
+                continue
+            yield row_number, str(row['id']).strip(), str(text).strip()
+
+
+def is_selected(row_number, line_id, id_prefix=None, start=None, stop=None):
+    # The row range is applied before the id filter
+    return ((start is None or row_number >= start) and (stop is None or row_number < stop)
+            and not (id_prefix and not line_id.startswith(id_prefix)))
+
+
+# (id, text) pairs of the lines selected by the id prefix and the row range
+def read_lines(path, id_prefix=None, start=None, stop=None):
+    for row_number, line_id, text in read_rows(path, stop):
+        if is_selected(row_number, line_id, id_prefix, start, stop):
+            yield line_id, text
+
+
+# Parse a "start-stop" row range from settings.ini. Either end can be left out.
+def parse_line_range(value):
+    if not value or not value.strip():
+        return None, None
+    start, _, stop = value.partition('-')
+    return (int(start) if start.strip() else None), (int(stop) if stop.strip() else None)
+
+
+class LineScript:
+    """
+    Re-iterable view of a lines file. Every pass over it streams the file again from disk,
+    so nested loops over voices and lines never hold the whole script in memory. Iterating yields
+    the selected lines; all_lines() also walks the lines before them, for names that count lines
+    over the whole script and must not change when only part of it is generated.
+    """
+
+    def __init__(self, path, id_prefix=None, start=None, stop=None, limit=None):
+        self.path = path
+        self.id_prefix = id_prefix
+        self.start = start
+        self.stop = stop
+        self.limit = limit  # Only the first `limit` selected lines
+
+    # The same script with only its first `count` selected lines selected
+    def head(self, count):
+        return LineScript(self.path, self.id_prefix, self.start, self.stop, count if self.limit is None else min(count, self.limit))
+
+    # (id, text, selected) for every line up to the last one that can be selected
+    def all_lines(self):
+        num_selected = 0
+        for row_number, line_id, text in read_rows(self.path, self.stop):
+            if self.limit is not None and num_selected >= self.limit:
+                return
+            selected = is_selected(row_number, line_id, self.id_prefix, self.start, self.stop)
+            num_selected += selected
+            yield line_id, text, selected
+
+    def __iter__(self):
+        return ((line_id, text) for line_id, text, selected in self.all_lines() if selected)
@@ -1,87 +1,363 @@
-import pandas as pd
-import requests
-import openai
-import json
-import time
-import re
-import os
-from dotenv import load_dotenv
-import datetime
-import csv
-import itertools
+import argparse
 import configparser
-import wave
-import elevenlabs
-from elevenlabs import generate, save
-import urllib.request
-import ssl
-ssl._create_default_https_context = ssl._create_unverified_context
-
-
-# Load environment variables from .env to get teh API keys
-load_dotenv()  # take environment variables from .env.
-
-ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
-CHATGPT_API_KEY = os.getenv('CHATGPT_API_KEY')
-
-# read the settings.ini file to get key configuration
-config = configparser.ConfigParser()
-config.read('settings.ini')
-
-# use a casting note to help select voices to use
-casting_note = config.get('Voice', 'casting_note')
-
-# use a casting note to help select voices to use
-listvoicesonly = config.getboolean('Voice', 'listvoicesonly')
-
-#Use or don't use the APIs based on Settings    
-use_elevenlabs = config.getboolean('Voice', 'use_elevenlabs')
-use_playht = config.getboolean('Voice', 'use_playht')
-
-# Define your ranges here
-stability_range = [float(value.strip()) for value in config.get('Settings', 'stability_range').split(",")]
-similarity_boost_range = [float(value.strip()) for value in config.get('Settings', 'similarity_boost_range').split(",")]
-
-
-VARIANTS = config.getint('Settings', 'variants')  # Number of variants per actor per line
-
-VARIANTS = range(1, VARIANTS + 1)
-settings_combinations = list(itertools.product(stability_range, similarity_boost_range, VARIANTS))
-#settings_combinations = list(itertools.product(stability_range, similarity_boost_range))
-
-
-elevenlabs_actors = config.getint('Settings', 'elevenlabs_actors')  # Number of actors to cast from ChatGPT's suggestions in addition to the specified_voice_names
-playht_actors = config.getint('Settings', 'playht_actors')  # Number of actors to cast from ChatGPT's suggestions in addition to the specified_voice_names
-
-CHUNK_SIZE = config.getint('System', 'chunk_size')
-
-# Play.ht settings
-PLAYHT_API_KEY = os.getenv('PLAYHT_API_KEY')
-PLAYHT_USER_ID = os.getenv('PLAYHT_USER_ID')  # Get the user ID from the environment
-PLAYHT_URL_GET_VOICES = config.get('PlayHT', 'url_get_voices')
-PLAYHT_URL_CONVERT = config.get('PlayHT', 'url_convert')
-PLAYHT_URL_STATUS = config.get('PlayHT', 'url_status')
-
-# Get the current time at the start of the program and format as a string
-start_time = datetime.datetime.now()
-start_time_str = start_time.strftime("%Y%m%d%H%M")
-
-# ElevenLabs API constants
-ELEVENLABS_URL = config.get('ElevenLabs', 'url')
-elevenlabs.set_api_key(ELEVENLABS_API_KEY)
-
-# ChatGPT API constants  
-CHATGPT_MODEL = config.get('ChatGPT', 'model')
-CHATGPT_URL = config.get('ChatGPT', 'url')
-
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from atomic_file import atomic_write
+from http_client import get_session, print_connection_stats
+from catalog_cache import load_catalog, save_catalog, catalog_is_fresh, revalidation_headers
+from casting_cache import casting_key, load_casting, save_casting, clear_casting_cache
+from voice_ranker import shortlist_voices
+from synthesis_cache import SynthesisCache, synthesis_key
+from job_manifest import JobManifest
+from line_reader import LineScript, parse_line_range
+from planner import CharacterLimiter, BudgetExhausted, plan_report, print_plan
+from metrics import Metrics, Progress
+from postprocess import PostProcessor
+from variant_sweep import audio_features, prune_settings
+from job_claims import JobClaims, LeaseDirectory, LEASE_DIR_NAME, job_id, parse_shard, parse_worker_id
+from credentials import Credential, CredentialPool, CredentialRejected, CredentialsRejected, CredentialsRejecting, NoCredentialAvailable, REJECTED_STATUS_CODES
+
+# Heavy modules (requests, openai, pydub) are imported inside the functions that use them,
+# and nothing is read or sent until main() runs, so quick commands start fast.
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# The synthesis cache is opened on first use because it scans its store
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+# One character limiter per provider, shared by all of its worker threads
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# One pool of API keys per provider, built on first use
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+# Latency, time to first byte, bytes, retries and status codes of every provider call and file write in this run
+metrics = Metrics()
+
+
+def load_settings(path='settings.ini'):
+    # Read the API keys from .env and the configuration from settings.ini into the module settings
+    global config, ELEVENLABS_API_KEY, CHATGPT_API_KEY, ELEVENLABS_API_KEYS, PLAYHT_API_KEYS, PLAYHT_USER_IDS, CREDENTIAL_MAX_FAILURES, CREDENTIAL_COOLDOWN
+    global casting_note, listvoicesonly, use_elevenlabs, use_playht, settings_combinations
+    global CHUNK_SIZE, CONCURRENCY, PROVIDER_CONCURRENCY, MAX_RETRIES, RETRY_BACKOFF, RETRY_FAILED_ONLY, CONNECT_TIMEOUT, READ_TIMEOUT
+    global PLAYHT_URL_GET_VOICES, PLAYHT_URL_CONVERT, PLAYHT_URL_STATUS, PLAYHT_POLL_INTERVAL, PLAYHT_POLL_BACKOFF, PLAYHT_MAX_POLL_INTERVAL, PLAYHT_BATCH_SIZE, PLAYHT_BATCH_MAX_CHARS
+    global CACHE_DIR, CATALOG_TTL, REFRESH_CATALOG, REFRESH_CASTING, SYNTHESIS_CACHE, SYNTHESIS_CACHE_SIZE_MB
+    global ELEVENLABS_URL, ELEVENLABS_URL_SUBSCRIPTION, ELEVENLABS_URL_TTS, ELEVENLABS_MODEL_ID, CHATGPT_MODEL, CHATGPT_URL, SHORTLIST_SIZE
+    global BUDGET, EXPECTED_LATENCY, ELEVENLABS_URL_ADD_VOICE, VERBOSE
+    global ADAPTIVE_SWEEP, SWEEP_PILOT_LINES, SWEEP_TOLERANCE
+    global POSTPROCESS, POSTPROCESS_DIR, TRIM_SILENCE, SILENCE_THRESHOLD_DB, TARGET_DBFS, POSTPROCESS_WORKERS
+    global SHARD, LEASES, WORKER_ID, LEASE_TTL
+
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env to get teh API keys
+    load_dotenv()  # take environment variables from .env.
+
+    # Several keys can be given separated by commas; the requests are then spread over all of them
+    ELEVENLABS_API_KEYS = split_keys(os.getenv('ELEVENLABS_API_KEY'))
+    # Voices are cloned on the first account
+    ELEVENLABS_API_KEY = ELEVENLABS_API_KEYS[0] if ELEVENLABS_API_KEYS else None
+    CHATGPT_API_KEY = os.getenv('CHATGPT_API_KEY')
+
+    # read the settings.ini file to get key configuration
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError(f"Settings file not found: {path}")
+
+    # use a casting note to help select voices to use
+    casting_note = config.get('Voice', 'casting_note')
+
+    # if true, only cast the voices and print them, without generating any lines
+    listvoicesonly = config.getboolean('Voice', 'listvoicesonly')
+
+    #Use or don't use the APIs based on Settings    
+    use_elevenlabs = config.getboolean('Voice', 'use_elevenlabs')
+    use_playht = config.getboolean('Voice', 'use_playht')
+
+    # Define your ranges here
+    stability_range = [float(value.strip()) for value in config.get('Settings', 'stability_range').split(",")]
+    similarity_boost_range = [float(value.strip()) for value in config.get('Settings', 'similarity_boost_range').split(",")]
+
+    variants = config.getint('Settings', 'variants')  # Number of variants per actor per line
+    settings_combinations = list(itertools.product(stability_range, similarity_boost_range, range(1, variants + 1)))
+    # Adaptive sweep: generate the first few lines with every settings point, then drop the points whose takes are broken or sound the same
+    ADAPTIVE_SWEEP = config.getboolean('Settings', 'adaptive_sweep', fallback=False)
+    SWEEP_PILOT_LINES = config.getint('Settings', 'sweep_pilot_lines', fallback=3)
+    SWEEP_TOLERANCE = config.getfloat('Settings', 'sweep_tolerance', fallback=0.05)
+
+
+    CHUNK_SIZE = config.getint('System', 'chunk_size')
+
+    # Concurrency and retry settings for the generation requests
+    CONCURRENCY = config.getint('System', 'concurrency', fallback=4)
+    # The providers run at the same time, each with its own limit. 0 uses `concurrency`.
+    PROVIDER_CONCURRENCY = {provider: config.getint('System', f'{provider}_concurrency', fallback=0) or CONCURRENCY for provider in ('elevenlabs', 'playht')}
+    MAX_RETRIES = config.getint('System', 'max_retries', fallback=5)
+    RETRY_BACKOFF = config.getfloat('System', 'retry_backoff', fallback=1.0)
+    # If true, only run the jobs the output directory's manifest lists as failed
+    RETRY_FAILED_ONLY = config.getboolean('System', 'retry_failed_only', fallback=False)
+    # Seconds to wait for a connection to open and for the server to send data
+    CONNECT_TIMEOUT = config.getfloat('System', 'connect_timeout', fallback=10.0)
+    READ_TIMEOUT = config.getfloat('System', 'read_timeout', fallback=120.0)
+    # Print a line for every job; otherwise only the progress line, errors and summaries are shown
+    VERBOSE = config.getboolean('System', 'verbose', fallback=False)
+
+    # Play.ht settings
+    # Keys and user IDs are paired up in order; a single user ID is used with every key
+    PLAYHT_API_KEYS = split_keys(os.getenv('PLAYHT_API_KEY'))
+    PLAYHT_USER_IDS = split_keys(os.getenv('PLAYHT_USER_ID'))  # Get the user ID from the environment
+    if len(PLAYHT_USER_IDS) == 1:
+        PLAYHT_USER_IDS = PLAYHT_USER_IDS * len(PLAYHT_API_KEYS)
+    PLAYHT_URL_GET_VOICES = config.get('PlayHT', 'url_get_voices')
+    PLAYHT_URL_CONVERT = config.get('PlayHT', 'url_convert')
+    PLAYHT_URL_STATUS = config.get('PlayHT', 'url_status')
+    PLAYHT_POLL_INTERVAL = config.getfloat('PlayHT', 'poll_interval', fallback=1.0)
+    PLAYHT_POLL_BACKOFF = config.getfloat('PlayHT', 'poll_backoff', fallback=1.5)
+    PLAYHT_MAX_POLL_INTERVAL = config.getfloat('PlayHT', 'max_poll_interval', fallback=10.0)
+    PLAYHT_BATCH_SIZE = config.getint('PlayHT', 'batch_size', fallback=1)
+    PLAYHT_BATCH_MAX_CHARS = config.getint('PlayHT', 'batch_max_chars', fallback=2000)
+
+    # Local cache settings. The voice catalogs are reused for catalog_ttl seconds before being revalidated with the API.
+    CACHE_DIR = config.get('Cache', 'directory', fallback='.cache')
+    CATALOG_TTL = config.getint('Cache', 'catalog_ttl', fallback=86400)
+    REFRESH_CATALOG = config.getboolean('Cache', 'refresh_catalog', fallback=False)
+    REFRESH_CASTING = config.getboolean('Cache', 'refresh_casting', fallback=False)
+    # Generated audio is kept in a content-addressed store so the same request is never paid for twice
+    SYNTHESIS_CACHE = config.getboolean('Cache', 'synthesis_cache', fallback=True)
+    SYNTHESIS_CACHE_SIZE_MB = config.getint('Cache', 'synthesis_cache_size_mb', fallback=2048)
+
+    # ElevenLabs API constants
+    ELEVENLABS_URL = config.get('ElevenLabs', 'url')
+    ELEVENLABS_URL_TTS = config.get('ElevenLabs', 'url_tts', fallback='https://api.elevenlabs.io/v1/text-to-speech')
+    ELEVENLABS_MODEL_ID = config.get('ElevenLabs', 'model_id', fallback='eleven_monolingual_v1')
+    ELEVENLABS_URL_ADD_VOICE = config.get('ElevenLabs', 'url_add_voice', fallback='https://api.elevenlabs.io/v1/voices/add')
+    ELEVENLABS_URL_SUBSCRIPTION = config.get('ElevenLabs', 'url_subscription', fallback='https://api.elevenlabs.io/v1/user/subscription')
+
+    # A key is taken out of rotation after this many rejected (401) or rate limited (429) responses in a row
+    CREDENTIAL_MAX_FAILURES = config.getint('Credentials', 'max_failures', fallback=3)
+    # Seconds a rate limited key sits out before it is tried again
+    CREDENTIAL_COOLDOWN = config.getfloat('Credentials', 'cooldown', fallback=60.0)
+
+    # ChatGPT API constants  
+    CHATGPT_MODEL = config.get('ChatGPT', 'model').strip("'\"")
+    CHATGPT_URL = config.get('ChatGPT', 'url')
+    # Number of voices, ranked locally against the casting note, that are sent to ChatGPT. 0 sends the whole catalog.
+    SHORTLIST_SIZE = config.getint('ChatGPT', 'shortlist_size', fallback=50)
+
+    # Characters per minute and total characters per run for each provider. 0 means unlimited.
+    BUDGET = {provider: (config.getint('Budget', f'{provider}_chars_per_minute', fallback=0), config.getint('Budget', f'{provider}_max_characters', fallback=0))
+              for provider in ('elevenlabs', 'playht')}
+    # Seconds a generation request is expected to take, for dry run estimates before the manifest has real timings
+    EXPECTED_LATENCY = config.getfloat('Budget', 'expected_latency', fallback=3.0)
+
+    # Optional post-processing of every take as soon as it is saved: conversion to 16-bit WAV, silence trimming and loudness normalization
+    POSTPROCESS = config.getboolean('PostProcess', 'enabled', fallback=False)
+    POSTPROCESS_DIR = config.get('PostProcess', 'directory', fallback='processed')
+    TRIM_SILENCE = config.getboolean('PostProcess', 'trim_silence', fallback=True)
+    SILENCE_THRESHOLD_DB = config.getfloat('PostProcess', 'silence_threshold_db', fallback=-50.0)
+    TARGET_DBFS = config.getfloat('PostProcess', 'target_dbfs', fallback=-20.0)
+    POSTPROCESS_WORKERS = config.getint('PostProcess', 'workers', fallback=0) or None
+
+    # Splitting one run over several workers sharing the output directory; generate --shard, --leases and --worker-id override these
+    SHARD = parse_shard(config.get('Sharding', 'shard', fallback=''))
+    LEASES = config.getboolean('Sharding', 'leases', fallback=False)
+    WORKER_ID = parse_worker_id(config.get('Sharding', 'worker_id', fallback=''))
+    LEASE_TTL = config.getfloat('Sharding', 'lease_ttl', fallback=60.0)
+
+
+def split_keys(value):
+    return [key.strip() for key in (value or '').split(',') if key.strip()]
+
+
+def get_credentials(provider):
+    with _credentials_lock:
+        if provider not in _credentials:
+            if provider == 'elevenlabs':
+                credentials = [Credential(f"key {i + 1}", {"xi-api-key": key}, key) for i, key in enumerate(ELEVENLABS_API_KEYS)]
+            else:
+                # Play.ht voices belong to the user ID and key pair, so both go into the catalog cache key
+                credentials = [Credential(f"key {i + 1}", {"Authorization": key, "X-User-Id": user_id}, f"{user_id}:{key}")
+                               for i, (key, user_id) in enumerate(zip(PLAYHT_API_KEYS, PLAYHT_USER_IDS))]
+            _credentials[provider] = CredentialPool(provider, credentials, CREDENTIAL_MAX_FAILURES, CREDENTIAL_COOLDOWN)
+        return _credentials[provider]
+
+
+def with_credential(provider, voice, characters, request):
+    # Call request(credential) with the best key for the voice, moving on to the next key when one is rejected or rate limited.
+    # Raises NoCredentialAvailable once the keys left are out of quota, and CredentialsRejected once every key rejected the request.
+    pool = get_credentials(provider)
+    tried = set()
+    rejected = []
+    while True:
+        try:
+            credential = pool.acquire(voice, characters, exclude=tried)
+        except CredentialsRejected:
+            if rejected:
+                raise CredentialsRejected(f"Every {provider} key rejected or rate limited the request ({'; '.join(rejected)})")
+            raise
+        started = time.perf_counter()
+        try:
+            result = request(credential)
+        except CredentialRejected as e:
+            pool.release(credential, refund=characters)
+            tried.add(credential.name)
+            rejected.append(str(e))
+            continue
+        except BaseException:
+            pool.release(credential, refund=characters)
+            raise
+        pool.release(credential, time.perf_counter() - started)
+        return result
+
+
+def get_audio_cache():
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None and SYNTHESIS_CACHE:
+            _audio_cache = SynthesisCache(os.path.join(CACHE_DIR, 'audio'), SYNTHESIS_CACHE_SIZE_MB * 1024 * 1024)
+    return _audio_cache
+
+
+def get_limiter(provider):
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = CharacterLimiter(*BUDGET[provider])
+        return _limiters[provider]
+
+
+def log(message):
+    # Per-job chatter, only shown with verbose = true in settings.ini
+    if VERBOSE:
+        print(message)
+
+
+def send_with_retry(provider, method, url, operation='request', credential=None, **kwargs):
+    # Send a request through the provider's pooled session, retrying rate limited (429) and server error (5xx) responses as well as
+    # connection errors with exponential backoff. A Retry-After header from the API wins over the backoff.
+    # The call is recorded in the run metrics under (provider, operation), retries included.
+    # With a credential its headers are added, and a final 401/429, or the key going out of rotation, raises CredentialRejected.
+    import requests
+
+    if credential is not None:
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **credential.headers)
+
+    # One pooled keep-alive session per provider, sized to match the generation concurrency
+    session = get_session(provider, PROVIDER_CONCURRENCY.get(provider, CONCURRENCY))
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    started = time.perf_counter()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= MAX_RETRIES:
+                metrics.record(provider, operation, time.perf_counter() - started, retries=attempt, error=True)
+                raise
+            reason = str(e)
+            delay = RETRY_BACKOFF * (2 ** attempt)
+        else:
+            if credential is not None and (not get_credentials(provider).report(credential, response.status_code)
+                                           or (response.status_code in REJECTED_STATUS_CODES and (response.status_code not in RETRY_STATUS_CODES or attempt >= MAX_RETRIES))):
+                metrics.record(provider, operation, time.perf_counter() - started, ttfb=response.elapsed.total_seconds(), retries=attempt,
+                               status=response.status_code, error=True)
+                response.close()
+                raise CredentialRejected(f"{provider} {credential.name} got status {response.status_code}")
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= MAX_RETRIES:
+                # A streamed body is counted by stream_to_file as it is read
+                metrics.record(provider, operation, time.perf_counter() - started, ttfb=response.elapsed.total_seconds(),
+                               bytes_transferred=0 if kwargs.get('stream') else len(response.content), retries=attempt,
+                               status=response.status_code, error=response.status_code >= 400)
+                if kwargs.get('stream') and response.status_code >= 400:
+                    # Nobody reads the body of a failed streamed call, so give its connection back now
+                    response.close()
+                return response
+            reason = f"status {response.status_code}"
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.replace('.', '', 1).isdigit() else RETRY_BACKOFF * (2 ** attempt)
+            response.close()
+        # Add some jitter so parallel workers don't retry in lockstep
+        delay += random.uniform(0, RETRY_BACKOFF)
+        print(f"Request to {url} failed ({reason}), retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+        time.sleep(delay)
+
+
+def stream_to_file(response, filename, provider, operation):
+    # Write the response body to a temp file in the output directory chunk by chunk and only rename it
+    # into place once the whole body is there, so a crash never leaves a truncated file that looks done.
+    started = time.perf_counter()
+    bytes_written = 0
+    try:
+        with atomic_write(filename, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    bytes_written += len(chunk)
+    except BaseException:
+        metrics.record(provider, 'write', time.perf_counter() - started, bytes_transferred=bytes_written, error=True)
+        metrics.add_bytes(provider, operation, bytes_written)
+        raise
+    finally:
+        response.close()
+    metrics.record(provider, 'write', time.perf_counter() - started, bytes_transferred=bytes_written)
+    # The body is also counted against the provider call that sent it
+    metrics.add_bytes(provider, operation, bytes_written)
+    return bytes_written
+
+
+def get_playht_voices(refresh=None, cached_only=False):
+    # The catalogs of every key, merged. Each voice is only used with the keys whose catalog has it.
+    return merge_catalogs('playht', 'name', lambda credential, source: fetch_playht_voices(credential, source, refresh, cached_only))
+
+
+# The cached catalog however old it is, for planning without calling the API
+def cached_catalog(label, cached, source):
+    if cached is None:
+        print(f"No cached {label} catalog{source}, planning without its voices")
+        return []
+    print(f"Loaded {len(cached['voices'])} voices from the {label} catalog cache{source}")
+    return cached['voices']
+
+
+def merge_catalogs(provider, id_field, fetch):
+    pool = get_credentials(provider)
+    voices = {}
+    for credential in pool.credentials:
+        source = f" ({credential.name})" if len(pool.credentials) > 1 else ""
+        try:
+            catalog = fetch(credential, source)
+        except CredentialRejected as e:
+            print(f"Could not fetch the voice catalog{source}. Error: {str(e)}")
+            continue
+        pool.add_voices(credential, [voice[id_field] for voice in catalog])
+        for voice in catalog:
+            voices.setdefault(voice[id_field], voice)
+    return list(voices.values())
+
+
+def fetch_playht_voices(credential, source='', refresh=None, cached_only=False):
+    if refresh is None:
+        refresh = REFRESH_CATALOG
+    account = credential.account
+    if cached_only:
+        return cached_catalog('Play.ht', load_catalog(CACHE_DIR, 'playht', account), source)
+    cached = None if refresh else load_catalog(CACHE_DIR, 'playht', account)
+    if catalog_is_fresh(cached, CATALOG_TTL):
+        print(f"Loaded {len(cached['voices'])} English voices from the Play.ht catalog cache{source}")
+        return cached['voices']
 
-def get_playht_voices():
     headers = {
-        "Accept": "application/json",
-        "Authorization": PLAYHT_API_KEY,
-        "X-User-Id": PLAYHT_USER_ID
+        "Accept": "application/json"
     }
-    response = requests.get(PLAYHT_URL_GET_VOICES, headers=headers)
+    headers.update(revalidation_headers(cached))
+    response = send_with_retry('playht', "GET", PLAYHT_URL_GET_VOICES, operation='voices', credential=credential, headers=headers)
     
     # Print the entire response
     #print("Response: ", response.__dict__)
@@ -90,36 +366,38 @@ def get_playht_voices():
     if response.status_code == 403:
         print("The provided API key's plan does not have access to the requested resource.")
         return []
+
+    if response.status_code == 304 and cached is not None:
+        save_catalog(CACHE_DIR, 'playht', account, None, entry=cached)
+        print(f"Play.ht catalog not modified, using {len(cached['voices'])} cached English voices{source}")
+        return cached['voices']
     
     voices = response.json()["voices"]
 
     
-    # Filter out non-English voices
+    # Filter out non-English voices. The filtered list is what gets cached.
     english_voices = [voice for voice in voices if 'English' in voice['language']]
+    save_catalog(CACHE_DIR, 'playht', account, english_voices, response)
     
-    print(f"Fetched {len(english_voices)} English voices from Play.ht")
+    print(f"Fetched {len(english_voices)} English voices from Play.ht{source}")
     return english_voices
 
 
 
-def generate_audio_playht(text, voice):
+def generate_audio_playht(text, voice, credential):
     headers = {
         "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": PLAYHT_API_KEY,
-        "X-User-Id": PLAYHT_USER_ID
+        "Content-Type": "application/json"
     }
     data = {
-        "content": [text],
+        # A list of lines is sent as one conversion
+        "content": text if isinstance(text, list) else [text],
         "voice": voice
     }
-    response = requests.post(PLAYHT_URL_CONVERT, headers=headers, json=data)
+    response = send_with_retry('playht', "POST", PLAYHT_URL_CONVERT, operation='convert', credential=credential, headers=headers, json=data)
     
     response_data = response.json()
     
-    # Print the response
-    print(f"Response from generate_audio_playht: {response_data}")
-    
     if "error" in response_data:
         print(f"Error: {response_data['error']} for voice {voice}. Skipping this voice.")
         return None
@@ -128,76 +406,135 @@ def generate_audio_playht(text, voice):
 
 
 
-def get_playht_audio_status(transcription_id):
+def get_playht_audio_status(transcription_id, credential):
+    # The conversion can only be looked up with the key that submitted it
     headers = {
-        "Accept": "application/json",
-        "Authorization": PLAYHT_API_KEY,
-        "X-User-Id": PLAYHT_USER_ID
+        "Accept": "application/json"
     }
     params = {
         "transcriptionId": transcription_id
     }
-    response = requests.get(PLAYHT_URL_STATUS, headers=headers, params=params)
-    response_data = response.json()
-    
-    # Print the status code and response data for debugging
-    print(f"Status code: {response.status_code}")
-    print(f"Response data: {response_data}")
-    
-    return response_data
+    response = send_with_retry('playht', "GET", PLAYHT_URL_STATUS, operation='status', credential=credential, headers=headers, params=params)
+    return response.json()
 
 
 
 
 
-def generate_audio_elevenlabs(text, voice_id, stability, similarity_boost):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+def generate_audio_elevenlabs(text, voice_id, stability, similarity_boost, filename, credential):
+    url = f"{ELEVENLABS_URL_TTS}/{voice_id}"
 
     headers = {
       "Accept": "audio/mpeg",
-      "Content-Type": "application/json",
-      "xi-api-key": ELEVENLABS_API_KEY
+      "Content-Type": "application/json"
     }
 
     data = {
       "text": text,
-      "model_id": "eleven_monolingual_v1",
+      "model_id": ELEVENLABS_MODEL_ID,
       "voice_settings": {
         "stability": stability,
         "similarity_boost": similarity_boost
       }
     }
 
-    response = requests.post(url, json=data, headers=headers)
-    audio_data = b""
-    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-        if chunk:
-            audio_data += chunk
-    return audio_data
+    response = send_with_retry('elevenlabs', "POST", url, operation='tts', credential=credential, json=data, headers=headers, stream=True)
+    response.raise_for_status()
+    # Stream the audio straight to disk and return the number of bytes written
+    return stream_to_file(response, filename, 'elevenlabs', 'tts')
+
 
+def get_elevenlabs_voices(refresh=None, cached_only=False):
+    # The catalogs of every key, merged. Cloned voices only exist on their own account, so each voice is only used with the keys whose catalog has it.
+    return merge_catalogs('elevenlabs', 'voice_id', lambda credential, source: fetch_elevenlabs_voices(credential, source, refresh, cached_only))
+
+
+def fetch_elevenlabs_voices(credential, source='', refresh=None, cached_only=False):
+    if refresh is None:
+        refresh = REFRESH_CATALOG
+    if cached_only:
+        return cached_catalog('ElevenLabs', load_catalog(CACHE_DIR, 'elevenlabs', credential.account), source)
+    cached = None if refresh else load_catalog(CACHE_DIR, 'elevenlabs', credential.account)
+    if catalog_is_fresh(cached, CATALOG_TTL):
+        print(f"Loaded {len(cached['voices'])} voices from the ElevenLabs catalog cache{source}")
+        return cached['voices']
 
-def get_elevenlabs_voices():
     headers = {
-        "Accept": "application/json",
-        "xi-api-key": ELEVENLABS_API_KEY
+        "Accept": "application/json"
     }
+    # Let the API answer 304 Not Modified if the cached catalog is still current
+    headers.update(revalidation_headers(cached))
 
     # API call 
-    response = requests.get(ELEVENLABS_URL, headers=headers)
+    response = send_with_retry('elevenlabs', "GET", ELEVENLABS_URL, operation='voices', credential=credential, headers=headers)
+
+    if response.status_code == 304 and cached is not None:
+        save_catalog(CACHE_DIR, 'elevenlabs', credential.account, None, entry=cached)
+        print(f"ElevenLabs catalog not modified, using {len(cached['voices'])} cached voices{source}")
+        return cached['voices']
 
     # Get voices list
     data = response.json()
     voices = data["voices"]
+    save_catalog(CACHE_DIR, 'elevenlabs', credential.account, voices, response)
 
-    print(f"Fetched {len(voices)} voices from ElevenLabs")
+    print(f"Fetched {len(voices)} voices from ElevenLabs{source}")
     
     return voices
 
+def fetch_elevenlabs_quotas():
+    # With several keys, start each one from the characters its subscription has left, so the emptiest account is used least
+    pool = get_credentials('elevenlabs')
+    if len(pool.credentials) < 2:
+        return
+    for credential in pool.credentials:
+        try:
+            response = send_with_retry('elevenlabs', "GET", ELEVENLABS_URL_SUBSCRIPTION, operation='subscription', credential=credential)
+            response.raise_for_status()
+            subscription = response.json()
+        except Exception as e:
+            print(f"Could not read the ElevenLabs character quota of {credential.name}, treating it as unlimited. Error: {str(e)}")
+            continue
+        characters_left = subscription['character_limit'] - subscription['character_count']
+        if characters_left <= 0:
+            credential.disabled = "no characters left this billing period"
+            print(f"ElevenLabs {credential.name} has no characters left this billing period, not using it")
+        else:
+            credential.max_characters = characters_left
+
+
+# Text the local ranker matches the casting note against for each voice
+def elevenlabs_voice_text(voice):
+    return ' '.join([voice['name'], voice.get('description') or ''] + [str(value) for value in (voice.get('labels') or {}).values()])
+
+
+def playht_voice_text(voice):
+    return ' '.join(str(voice.get(field) or '') for field in ('name', 'gender', 'language', 'accent', 'age', 'style', 'description'))
+
+
 # Updated function to include gender and accent
 
 
-def pick_best_voices_elevenlabs(voices, casting_note, num_suggestions):
+def pick_best_voices_elevenlabs(voices, casting_note, num_suggestions, refresh=None, cached_only=False):
+    if refresh is None:
+        refresh = REFRESH_CASTING
+    # Only the voices that best match the casting note locally are sent to the model
+    voices = shortlist_voices(voices, casting_note, SHORTLIST_SIZE, elevenlabs_voice_text, CACHE_DIR)
+    # Reuse the cast picked by an earlier run for the same catalog, casting note and model
+    key = casting_key('elevenlabs', voices, casting_note, num_suggestions, CHATGPT_MODEL)
+    if refresh:
+        print("Casting cache refresh requested")
+    else:
+        top_voices = load_casting(CACHE_DIR, key, voices, 'voice_id')
+        if top_voices is not None:
+            return top_voices
+    if cached_only:
+        print(f"No cached cast for this catalog and casting note, planning without the {num_suggestions} voice(s) ChatGPT would pick")
+        return []
+
+    import openai
     openai.api_key = CHATGPT_API_KEY
+    openai.api_base = CHATGPT_URL.rsplit('/chat/completions', 1)[0]
 
     # transform voice data into a string format
     voices_string = ', '.join([f"{voice['name']} (gender: {voice['labels'].get('gender', 'N/A')}, language: {voice['labels'].get('language', 'N/A')}, accent: {voice['labels'].get('accent', 'N/A')})" for voice in voices])
@@ -215,10 +552,16 @@ def pick_best_voices_elevenlabs(voices, casting_note, num_suggestions):
     messages = [system_message, user_message]
     
     # call the model
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-16k",
-        messages=messages
-    )
+    started = time.perf_counter()
+    try:
+        response = openai.ChatCompletion.create(
+            model=CHATGPT_MODEL,
+            messages=messages
+        )
+    except Exception:
+        metrics.record('openai', 'casting', time.perf_counter() - started, error=True)
+        raise
+    metrics.record('openai', 'casting', time.perf_counter() - started)
     
     # extract the message from the response
     response_message = response['choices'][0]['message']['content']
@@ -230,13 +573,32 @@ def pick_best_voices_elevenlabs(voices, casting_note, num_suggestions):
     voice_names_in_response = [match.group(1).lower() for match in re.finditer(r"\d+\. ([\w\s]+?)(\s*[-:\(]|$)", response_message)]
     # filter original voices list to get top voices with all information
     top_voices = [voice for voice in voices if voice['name'].lower() in voice_names_in_response][:num_suggestions]
+    save_casting(CACHE_DIR, key, top_voices, 'voice_id', response_message)
 
 
     return top_voices
 
 
-def pick_best_voices_playht(voices, casting_note, num_suggestions):
+def pick_best_voices_playht(voices, casting_note, num_suggestions, refresh=None, cached_only=False):
+    if refresh is None:
+        refresh = REFRESH_CASTING
+    # Only the voices that best match the casting note locally are sent to the model
+    voices = shortlist_voices(voices, casting_note, SHORTLIST_SIZE, playht_voice_text, CACHE_DIR)
+    # Reuse the cast picked by an earlier run for the same catalog, casting note and model
+    key = casting_key('playht', voices, casting_note, num_suggestions, CHATGPT_MODEL)
+    if refresh:
+        print("Casting cache refresh requested")
+    else:
+        top_voices = load_casting(CACHE_DIR, key, voices, 'name')
+        if top_voices is not None:
+            return top_voices
+    if cached_only:
+        print(f"No cached cast for this catalog and casting note, planning without the {num_suggestions} voice(s) ChatGPT would pick")
+        return []
+
+    import openai
     openai.api_key = CHATGPT_API_KEY
+    openai.api_base = CHATGPT_URL.rsplit('/chat/completions', 1)[0]
 
     # transform voice data into a string format
     voices_string = ', '.join([f"{voice['name']} (gender: {voice['gender']}, language: {voice['language']})" for voice in voices])
@@ -253,10 +615,16 @@ def pick_best_voices_playht(voices, casting_note, num_suggestions):
     messages = [system_message, user_message]
     
     # call the model
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-16k",
-        messages=messages
-    )
+    started = time.perf_counter()
+    try:
+        response = openai.ChatCompletion.create(
+            model=CHATGPT_MODEL,
+            messages=messages
+        )
+    except Exception:
+        metrics.record('openai', 'casting', time.perf_counter() - started, error=True)
+        raise
+    metrics.record('openai', 'casting', time.perf_counter() - started)
     
     # extract the message from the response
     response_message = response['choices'][0]['message']['content']
@@ -269,6 +637,7 @@ def pick_best_voices_playht(voices, casting_note, num_suggestions):
 
     # filter original voices list to get top voices with all information, preserving the order of ranking
     top_voices = [next(voice for voice in voices if voice['name'].lower() == name) for name in voice_names_in_response][:num_suggestions]
+    save_casting(CACHE_DIR, key, top_voices, 'name', response_message)
 
     return top_voices
 
@@ -289,7 +658,8 @@ def add_specified_voices(voices, specified_voice_names, all_voices):
 
 def download_and_save_file(url, filename):
     # Download the file
-    response = requests.get(url)
+    response = send_with_retry('playht', "GET", url, operation='download', stream=True)
+    response.raise_for_status()
     
     # Check the file format from the URL
     base_url = url.split('?')[0]  # Split the URL at the first '?'
@@ -298,14 +668,18 @@ def download_and_save_file(url, filename):
     if file_format == 'mp3':
         filename = filename.replace('.wav', '.mp3')  # Change the filename to .mp3
     elif file_format != 'wav':
+        response.close()
         raise ValueError(f"Unsupported file format: {file_format}")
     
-    with open(filename, 'wb') as f:
-        f.write(response.content)
+    return stream_to_file(response, filename, 'playht', 'download')
 
 
-def generate_voices_for_elevenlabs(final_voices, lines, settings_combinations, dir_name):
-    # Generate voices for the platform
+def plan_elevenlabs_jobs(final_voices, lines, settings_combinations, dir_name, keep=None):
+    # Yield the jobs in a fixed order so the filenames and variant letters are the same
+    # no matter in which order the requests finish or which files already exist.
+    # With `keep`, only the jobs for those settings points are yielded, still named as in the full grid.
+    # The letters count over every line of the script, so lines left out by the id prefix or row range
+    # get the same names as in a run over the whole script.
     for voice_info in final_voices:
         voice_name = voice_info['name']
         voice_id = voice_info['voice_id']
@@ -314,8 +688,8 @@ def generate_voices_for_elevenlabs(final_voices, lines, settings_combinations, d
         variant_letters = {}  # Initialize the dictionary to track variant letters for this voice
         settings_seen = set()  # Initialize the set to track unique combinations of stability and similarity for this voice
 
-        for line in lines:
-            line_id, line_text = line
+        rows = lines.all_lines() if isinstance(lines, LineScript) else ((line_id, line_text, True) for line_id, line_text in lines)
+        for line_id, line_text, selected in rows:
             for settings in settings_combinations:
                 stability, similarity_boost, variant = settings
                 # Create a unique key for each combination of stability and similarity_boost
@@ -327,149 +701,798 @@ def generate_voices_for_elevenlabs(final_voices, lines, settings_combinations, d
                     settings_seen.add(settings_key)  # Add this combination to the set of seen combinations
                 # Get the current variant letter for this combination of settings
                 variant_letter = variant_letters[settings_key]
-                filename = f"{dir_name}/{voice_name}_{line_id}_variant_{variant_number}{variant_letter}_stability_{stability}_similarity_{similarity_boost}.wav"
-                # Check if file exists
-                if os.path.exists(filename):
-                    print(f"File {filename} already exists, skipping...")
-                    continue
-                try:
-                    print(f"Generating line: {voice_name}_{line_text} with stability: {stability}, similarity boost: {similarity_boost} and variant: {variant_number}{variant_letter}")  # Log the line being processed
-                    # Generate the audio
-                    audio = generate_audio_elevenlabs(text=line_text, voice_id=voice_id, stability=stability, similarity_boost=similarity_boost)
-                    # Save the audio file
-                    with open(filename, 'wb') as f:
-                        f.write(audio)
-                except Exception as e:
-                    print(f"Failed to generate audio for line: {line_text}. Error: {str(e)}")
                 # Increment the variant letter for this combination of settings
-                next_variant_letter = chr(ord(variant_letter) + 1)
-                variant_letters[settings_key] = next_variant_letter
+                variant_letters[settings_key] = chr(ord(variant_letter) + 1)
+                if not selected or (keep is not None and settings not in keep):
+                    continue
+                filename = f"{dir_name}/{voice_name}_{line_id}_variant_{variant_number}{variant_letter}_stability_{stability}_similarity_{similarity_boost}.wav"
+                yield {
+                    'job_id': job_id('elevenlabs', voice_id, line_id, stability, similarity_boost, variant),
+                    'voice_name': voice_name,
+                    'voice_id': voice_id,
+                    'line_id': line_id,
+                    'line_text': line_text,
+                    'stability': stability,
+                    'similarity_boost': similarity_boost,
+                    'variant': f"{variant_number}{variant_letter}",
+                    'variant_index': variant,
+                    'filename': filename
+                }
+
+
+def job_key(job):
+    # Jobs are identified in the manifest by their output file name
+    return os.path.basename(job['filename'])
+
+
+def select_jobs(manifest, jobs, retry_failed_only=None, plan_batch_size=500, progress=None, claims=None, busy=None, plan=True):
+    # Jobs another worker holds are waited for after the others, or added to `busy` for the caller to wait for later.
+    # Without `plan` the caller records the jobs as planned itself, once it has claimed them.
+    if retry_failed_only is None:
+        retry_failed_only = RETRY_FAILED_ONLY
+    if claims is None:
+        claims = JobClaims()
+    # Decide what still has to run from the manifest loaded at startup, without touching the files.
+    # Jobs are passed through as they come so generation can start before the whole script is read.
+    num_jobs = 0
+    num_selected = 0
+    num_elsewhere = 0
+    to_plan = []
+    wait_here = busy is None
+    if wait_here:
+        busy = []
+
+    try:
+        for job in jobs:
+            if not claims.in_shard(job):
+                if progress is not None:
+                    progress.skip()
+                continue
+            num_jobs += 1
+            status = manifest.status(job_key(job))
+            claim = 'skip' if status == 'done' or (retry_failed_only and status != 'failed') else claims.claim(job)
+            if claim != 'run':
+                if claim == 'busy':
+                    busy.append(job)
+                elif progress is not None:
+                    progress.skip()
+                num_elsewhere += claim == 'done'
+                continue
+            num_selected += 1
+            # Planned records are written in batches rather than one append per job
+            if plan:
+                to_plan.append(job_key(job))
+            if len(to_plan) >= plan_batch_size:
+                manifest.plan(to_plan)
+                to_plan = []
+            yield job
+    finally:
+        # Also when the caller stops early and closes the generator, so every job it was handed is recorded
+        manifest.plan(to_plan)
+    elsewhere = f", {num_elsewhere} were generated by other workers" if num_elsewhere else ""
+    waiting = f", {len(busy)} are held by other workers" if busy else ""
+    print(f"{num_selected} of {num_jobs} jobs selected to run, the rest are already done" + (" or have not failed" if retry_failed_only else "") + elsewhere + waiting)
+    if wait_here:
+        yield from claim_busy_jobs(manifest, busy, claims, progress)
+
+
+def claim_busy_jobs(manifest, busy, claims, progress=None):
+    # Check the jobs other workers hold until each one is saved by its worker, or its lease expires and it is claimed here
+    num_claimed = 0
+    while busy:
+        time.sleep(claims.poll_interval)
+        still_busy = []
+        for job in busy:
+            claim = claims.claim(job)
+            if claim == 'busy':
+                still_busy.append(job)
+            elif claim == 'done':
+                if progress is not None:
+                    progress.skip()
+            else:
+                num_claimed += 1
+                manifest.plan([job_key(job)])
+                yield job
+        busy = still_busy
+    if num_claimed:
+        print(f"Claimed {num_claimed} jobs that other workers did not finish")
+
+
+def run_elevenlabs_job(job, provider):
+    # Returns the number of bytes written and whether they came from the synthesis cache
+    audio_cache = get_audio_cache()
+    if audio_cache is not None:
+        key = provider.cache_key(job)
+        if audio_cache.fetch(key, job['filename']):
+            log(f"Reused cached audio for {job['filename']}")
+            return os.path.getsize(job['filename']), True
+    # Wait for the characters-per-minute limit, and stop once the run's character budget is spent
+    if get_credentials('elevenlabs').rejecting:
+        raise CredentialsRejecting("Every ElevenLabs key is out of rotation")
+    if not get_limiter('elevenlabs').acquire(len(job['line_text'])):
+        raise BudgetExhausted(f"ElevenLabs character budget of {BUDGET['elevenlabs'][1]} reached")
+    log(f"Generating line: {job['voice_name']}_{job['line_text']} with stability: {job['stability']}, similarity boost: {job['similarity_boost']} and variant: {job['variant']}")  # Log the line being processed
+    bytes_written = provider.synthesize(job)
+    if audio_cache is not None:
+        audio_cache.store(key, job['filename'])
+    return bytes_written, False
+
+
+def generate_voices_for_elevenlabs(final_voices, lines, settings_combinations, dir_name, concurrency=None, postprocessor=None, keep=None, manifest=None, claims=None, provider=None):
+    if provider is None:
+        provider = ElevenLabsProvider()
+    concurrency = concurrency or provider.concurrency
+    if manifest is None:
+        manifest = JobManifest(dir_name)
+    if claims is None:
+        claims = JobClaims()
+    # Start from every job in the matrix; select_jobs takes off the ones that are already done as it reads them
+    progress = Progress("ElevenLabs", len(final_voices) * len(keep if keep is not None else settings_combinations) * sum(1 for _ in lines))
+    jobs = select_jobs(manifest, plan_elevenlabs_jobs(final_voices, lines, settings_combinations, dir_name, keep), progress=progress, claims=claims)
+
+    def timed_job(job):
+        started = time.monotonic()
+        bytes_written, cached = run_elevenlabs_job(job, provider)
+        return bytes_written, cached, time.monotonic() - started
+
+    def finish(future, job):
+        claims.release(job)
+        try:
+            bytes_written, cached, latency = future.result()
+        except (BudgetExhausted, CredentialsRejecting):
+            # Left as planned in the manifest so the next run picks it up
+            progress.skip()
+            return
+        except Exception as e:
+            print(f"Failed to generate audio for line: {job['line_text']}. Error: {str(e)}")
+            manifest.record(job_key(job), 'failed', error=str(e))
+            progress.update(failed=True)
+            return
+        manifest.record(job_key(job), 'done', bytes_written=bytes_written, latency=latency, cached=cached)
+        progress.update(bytes_written)
+        if postprocessor is not None:
+            postprocessor.submit(job['filename'])
+
+    # Send the requests in parallel, at most `concurrency` at a time. Only a couple of jobs per worker
+    # are queued ahead, so jobs are read from the lines file as the workers get to them.
+    limiter = get_limiter('elevenlabs')
+    credentials = get_credentials('elevenlabs')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        for job in jobs:
+            stop = None
+            if limiter.exhausted:
+                stop = f"ElevenLabs character budget of {limiter.max_characters} reached after {limiter.characters_used} characters"
+            elif credentials.exhausted:
+                stop = "Every ElevenLabs key is out of quota"
+            elif credentials.rejecting:
+                stop = f"Every ElevenLabs key is out of rotation ({credentials.rejections()})"
+            if stop is not None:
+                print(f"{stop}, not starting any more jobs")
+                # This job stays planned; the ones not read yet are selected again by the next run
+                claims.release(job)
+                break
+            if len(futures) >= 2 * concurrency:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future, futures.pop(future))
+            futures[executor.submit(timed_job, job)] = job
+        # Stop reading the lines file and write the planned records of the jobs selected so far
+        jobs.close()
+        for future in as_completed(futures):
+            finish(future, futures[future])
+    progress.close()
+    print(f"Manifest for {dir_name}: {manifest.summary()}")
+
+
+
+def sweep_elevenlabs_settings(final_voices, lines, settings_combinations, dir_name, postprocessor=None, manifest=None, claims=None, provider=None):
+    # Generate the pilot lines with every settings point and return the points worth generating for the rest of the script.
+    # The pilot takes are part of the normal output, so the full run finds them done in the manifest.
+    # Every worker needs all the pilot takes to make the same decision, so the pilot is not sharded.
+    pilot_lines = lines.head(SWEEP_PILOT_LINES) if isinstance(lines, LineScript) else list(itertools.islice(lines, SWEEP_PILOT_LINES))
+    print(f"Adaptive sweep: generating {sum(1 for _ in pilot_lines)} pilot line(s) with all {len(settings_combinations)} settings points")
+    generate_voices_for_elevenlabs(final_voices, pilot_lines, settings_combinations, dir_name, postprocessor=postprocessor, manifest=manifest,
+                                   claims=claims.unsharded() if claims is not None else None, provider=provider)
+
+    pilot_features = {}
+    for job in plan_elevenlabs_jobs(final_voices, pilot_lines, settings_combinations, dir_name):
+        if not os.path.exists(job['filename']):
+            continue
+        try:
+            features = audio_features(job['filename'])
+        except Exception as e:
+            print(f"Could not analyse pilot take {job['filename']}. Error: {str(e)}")
+            continue
+        point = (job['stability'], job['similarity_boost'], job['variant_index'])
+        pilot_features.setdefault(point, {})[(job['voice_id'], job['line_id'])] = features
+
+    kept, dropped = prune_settings(settings_combinations, pilot_features, SWEEP_TOLERANCE)
+    for (stability, similarity_boost, variant), reason in dropped.items():
+        log(f"Dropped stability {stability}, similarity {similarity_boost}, variant {variant}: {reason}")
+    if not kept:
+        print("Adaptive sweep dropped every settings point, generating the full grid instead")
+        return settings_combinations
+    print(f"Adaptive sweep kept {len(kept)} of {len(settings_combinations)} settings points "
+          f"({sum(reason == 'broken' for reason in dropped.values())} broken, {sum(reason != 'broken' for reason in dropped.values())} near duplicates)")
+    return kept
+
+
+def playht_audio_urls(audio_status):
+    # Return the list of audio URLs once a Play.ht transcription is done, otherwise None
+    audio_ready = False
+    if 'converted' in audio_status:
+        audio_ready = audio_status["converted"]
+    elif 'transcriped' in audio_status:
+        audio_ready = audio_status["transcriped"]
+    if not audio_ready or 'audioUrl' not in audio_status:
+        return None
+    audio_urls = audio_status["audioUrl"]
+    if isinstance(audio_urls, str):
+        # Play.ht API gives a string
+        audio_urls = [audio_urls]
+    return audio_urls
+
+
+def playht_synthesis_key(job):
+    return synthesis_key('playht', job['voice_name'], None, job['line_text'])
+
+
+def download_playht_job(job, audio_urls):
+    for audio_url in audio_urls:
+        try:
+            # Try to download the file
+            download_and_save_file(audio_url, job['filename'])
+            audio_cache = get_audio_cache()
+            if audio_cache is not None:
+                audio_cache.store(playht_synthesis_key(job), job['filename'])
+            log(f"Saved audio file for voice {job['voice_name']} line {job['line_id']} at {job['filename']}")
+            return True
+        except Exception as e:
+            print(f'Error while downloading file: {e}')
+    return False
+
+
+def plan_playht_batches(jobs, batch_size=None, max_chars=None):
+    batch_size = batch_size or PLAYHT_BATCH_SIZE
+    max_chars = max_chars or PLAYHT_BATCH_MAX_CHARS
+    # Pack consecutive lines for the same voice into one conversion, up to batch_size lines and max_chars characters
+    batches = []
+    open_batches = {}
+    for job in jobs:
+        batch = open_batches.get(job['voice_name'])
+        if batch is None or len(batch['jobs']) >= batch_size or batch['chars'] + len(job['line_text']) > max_chars:
+            batch = {'voice_name': job['voice_name'], 'jobs': [], 'chars': 0, 'saved': set()}
+            open_batches[job['voice_name']] = batch
+            batches.append(batch)
+        batch['jobs'].append(job)
+        batch['chars'] += len(job['line_text'])
+    return batches
+
+
+def reschedule_playht_batch(pending, transcription_id, batch, max_attempts, manifest, progress, claims):
+    if batch['attempt'] >= max_attempts:
+        for job in batch['jobs']:
+            if job['filename'] in batch['saved']:
+                continue
+            print(f"Stopped waiting for voice {job['voice_name']} line {job['line_id']} after {max_attempts} attempts.")
+            manifest.record(job_key(job), 'failed', latency=time.monotonic() - batch['started'], error=f"audio not ready after {max_attempts} attempts")
+            claims.release(job)
+            progress.update(failed=True)
+        pending.pop(transcription_id, None)
+        return
+    batch['interval'] = min(batch['interval'] * PLAYHT_POLL_BACKOFF, PLAYHT_MAX_POLL_INTERVAL)
+    batch['next_poll'] = time.monotonic() + batch['interval']
+    pending[transcription_id] = batch
+
+
+def submit_playht_batch(batch):
+    # With leases the lines are claimed only now, so the batches this worker hasn't reached yet are left to the others
+    claims = batch.get('claims')
+    if claims is not None:
+        claimed = []
+        for job in batch['jobs']:
+            claim = claims.claim(job)
+            if claim == 'run':
+                claimed.append(job)
+            else:
+                batch.setdefault(claim, []).append(job)
+        batch.update(jobs=claimed, chars=sum(len(job['line_text']) for job in claimed))
+        if not claimed:
+            return None
+    batch['started'] = time.monotonic()
+    texts = [job['line_text'] for job in batch['jobs']]
+    # Every key is out of rotation for good, so this batch could only fail
+    if get_credentials('playht').rejecting:
+        batch['not_started'] = True
+        return None
+    # Wait for the characters-per-minute limit, and stop once the run's character budget is spent
+    if not get_limiter('playht').acquire(sum(len(text) for text in texts)):
+        batch['not_started'] = True
+        return None
+    # The key that submitted the conversion is kept with the batch, the status can only be polled with it
+    try:
+        transcription_id, batch['credential'] = with_credential('playht', batch['voice_name'], batch['chars'], lambda credential: (
+            generate_audio_playht(text=texts if len(texts) > 1 else texts[0], voice=batch['voice_name'], credential=credential), credential))
+        return transcription_id
+    except NoCredentialAvailable:
+        batch['not_started'] = True
+        return None
+    except Exception as e:
+        print(f"Failed to submit {len(texts)} line(s) for voice {batch['voice_name']}. Error: {str(e)}")
+        batch['error'] = str(e)
+        return None
 
 
+def poll_playht_job(transcription_id, credential):
+    try:
+        return get_playht_audio_status(transcription_id, credential)
+    except Exception as e:
+        print(f"Failed to get the status of transcription {transcription_id}. Error: {str(e)}")
+        return {}
 
-def generate_voices_for_playht(final_voices, lines, dir_name, max_attempts=10):
 
-    # Generate voice lines for the selected voices
+def download_playht_batch(batch, audio_urls):
+    # Returns the jobs of the batch saved by this call
+    jobs = batch['jobs']
+    if len(jobs) == 1:
+        # For a single line every URL is the same audio, so try them in turn
+        return jobs if download_playht_job(jobs[0], audio_urls) else []
+    # For a batch Play.ht gives one URL per line, in the order the lines were sent
+    return [job for job, audio_url in zip(jobs, audio_urls) if job['filename'] not in batch['saved'] and download_playht_job(job, [audio_url])]
+
+
+def plan_playht_jobs(final_voices, lines, dir_name):
     for voice_info in final_voices:
         voice_name = voice_info["name"]
         for line in lines:
             line_id, line_text = line
             filename = f"{dir_name}/playht_{voice_name}_{line_id}.mp3"
-            # Check if file exists
-            if os.path.exists(filename):
-                print(f"File {filename} already exists, skipping...")
-                continue
-            transcription_id = generate_audio_playht(text=line_text, voice=voice_name)
-            if transcription_id is None:
-                print(f"Skipping voice {voice_name} for line {line_id} due to error in audio generation.")
+            yield {'job_id': job_id('playht', voice_name, line_id), 'voice_name': voice_name, 'line_id': line_id, 'line_text': line_text, 'filename': filename}
+
+
+def run_playht_jobs(jobs, max_attempts, concurrency, postprocessor, manifest, progress, claims, provider):
+    # Submit the jobs in batches, poll the conversions and download the audio as each one is ready, through the provider's interface.
+    # Returns the jobs another worker held when their batch was submitted, for the caller to wait for.
+    busy = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        batch_by_transcription_id = {}
+
+        def submit(batches):
+            # Submit the conversions together so Play.ht works on all of them at the same time
+            for batch in batches:
+                batch['claims'] = claims
+            for batch, transcription_id in zip(batches, executor.map(provider.synthesize, batches)):
+                busy.extend(batch.get('busy', []))
+                progress.skip(len(batch.get('done', [])))
+                if not batch['jobs']:
+                    continue
+                manifest.plan([job_key(job) for job in batch['jobs']])
+                if batch.get('not_started'):
+                    # Left as planned in the manifest so the next run picks them up
+                    for job in batch['jobs']:
+                        claims.release(job)
+                    progress.skip(len(batch['jobs']))
+                    continue
+                if transcription_id is None:
+                    for job in batch['jobs']:
+                        print(f"Skipping voice {job['voice_name']} for line {job['line_id']} due to error in audio generation.")
+                        manifest.record(job_key(job), 'failed', error=batch.get('error', "convert request failed"))
+                        claims.release(job)
+                        progress.update(failed=True)
+                    continue
+                # Each conversion is polled on its own schedule: quickly at first, then backing off while it is still converting
+                batch.update(transcription_id=transcription_id, attempt=0, interval=PLAYHT_POLL_INTERVAL, next_poll=time.monotonic() + PLAYHT_POLL_INTERVAL)
+                pending[transcription_id] = batch
+                batch_by_transcription_id[transcription_id] = batch
+
+        submit(plan_playht_batches(jobs))
+
+        downloads = {}
+        while pending or downloads:
+            now = time.monotonic()
+            due = [transcription_id for transcription_id, batch in pending.items() if batch['next_poll'] <= now]
+            unsplit = []
+            ready = executor.map(provider.poll, [pending[transcription_id] for transcription_id in due])
+            for transcription_id, audio_urls in zip(due, ready):
+                batch = pending[transcription_id]
+                batch['attempt'] += 1
+                if audio_urls and 1 < len(batch['jobs']) != len(audio_urls):
+                    # The batch came back as a single file we can't map to its lines, convert them one at a time instead
+                    print(f"Play.ht returned {len(audio_urls)} audio file(s) for {len(batch['jobs'])} lines of voice {batch['voice_name']}, converting them one at a time")
+                    unsplit.extend(job for job in batch['jobs'] if job['filename'] not in batch['saved'])
+                    del pending[transcription_id]
+                    continue
+                if audio_urls:
+                    # Download finished audio straight away while the other conversions keep going
+                    downloads[executor.submit(provider.download, batch, audio_urls)] = transcription_id
+                    del pending[transcription_id]
+                    continue
+                log(f"Attempt #{batch['attempt']}: waiting for audio to be ready for voice {batch['voice_name']} line(s) {', '.join(str(job['line_id']) for job in batch['jobs'])}...")
+                reschedule_playht_batch(pending, transcription_id, batch, max_attempts, manifest, progress, claims)
+            if unsplit:
+                submit(plan_playht_batches(unsplit, batch_size=1))
+
+            for future in [future for future in downloads if future.done()]:
+                transcription_id = downloads.pop(future)
+                batch = batch_by_transcription_id[transcription_id]
+                for job in future.result():
+                    batch['saved'].add(job['filename'])
+                    manifest.record(job_key(job), 'done', bytes_written=os.path.getsize(job['filename']), latency=time.monotonic() - batch['started'])
+                    claims.release(job)
+                    progress.update(os.path.getsize(job['filename']))
+                    if postprocessor is not None:
+                        postprocessor.submit(job['filename'])
+                if len(batch['saved']) < len(batch['jobs']):
+                    # Some of the audio URLs could not be downloaded yet, go back to polling this conversion
+                    log(f"Waiting for audio to be ready for voice {batch['voice_name']}...")
+                    reschedule_playht_batch(pending, transcription_id, batch, max_attempts, manifest, progress, claims)
+
+            # Sleep until the next conversion is due for polling or a download finishes, whichever comes first
+            timeout = max(0.0, min(batch['next_poll'] for batch in pending.values()) - time.monotonic()) if pending else None
+            if downloads:
+                wait(downloads, timeout=timeout, return_when=FIRST_COMPLETED)
+            elif timeout:
+                time.sleep(timeout)
+    return busy
+
+
+def generate_voices_for_playht(final_voices, lines, dir_name, max_attempts=10, concurrency=None, postprocessor=None, manifest=None, claims=None, provider=None):
+    if provider is None:
+        provider = PlayHTProvider()
+    concurrency = concurrency or provider.concurrency
+    audio_cache = get_audio_cache()
+    if manifest is None:
+        manifest = JobManifest(dir_name)
+    if claims is None:
+        claims = JobClaims()
+
+    def uncached(jobs):
+        to_generate = []
+        for job in jobs:
+            if audio_cache is not None and audio_cache.fetch(playht_synthesis_key(job), job['filename']):
+                log(f"Reused cached audio for {job['filename']}")
+                manifest.record(job_key(job), 'done', bytes_written=os.path.getsize(job['filename']), cached=True)
+                claims.release(job)
+                if postprocessor is not None:
+                    postprocessor.submit(job['filename'])
                 continue
-            attempt = 0
-            while True:
-                attempt += 1
-                audio_status = get_playht_audio_status(transcription_id)
-                print(f"Attempt #{attempt}: Audio status for voice {voice_name}, line {line_id}: {audio_status}")  # print the audio status for debugging
-                audio_ready = False
-                if 'converted' in audio_status:
-                    audio_ready = audio_status["converted"]
-                elif 'transcriped' in audio_status:
-                    audio_ready = audio_status["transcriped"]
-                if audio_ready and 'audioUrl' in audio_status:
-                    audio_urls = audio_status["audioUrl"]
-                    if isinstance(audio_urls, str):
-                        # Play.ht API gives a string
-                        audio_urls = [audio_urls]
-                    download_successful = False
-                    for audio_url in audio_urls:
-                        try:
-                            # Try to download the file
-                            download_and_save_file(audio_url, filename)
-                            print(f'Saved audio file for voice {voice_name} line {line_id} at {filename}')
-                            download_successful = True
-                            break  # exit the 'for' loop once the audio has been saved
-                        except Exception as e:
-                            print(f'Error while downloading file: {e}')
-                    if download_successful:
-                        break  # exit the 'while' loop if a download was successful
-                    else:
-                        print(f'Waiting for audio to be ready for voice {voice_name} line {line_id}...')
-                else:
-                    print(f'Waiting for audio to be ready for voice {voice_name} line {line_id}...')
-                if attempt >= max_attempts:
-                    print(f'Stopped waiting for voice {voice_name} line {line_id} after {max_attempts} attempts.')
-                    break
-                time.sleep(5)
-
-
-# Load the voice lines from the CSV file
-lines_file = config.get('Settings', 'lines_file')
-df = pd.read_csv(lines_file)
-lines = list(df[['id', 'text']].itertuples(index=False, name=None))
-
-# Define your directory name
-dir_name = config.get('System', 'directory_name')
-
-# Ensure the directory exists
-os.makedirs(dir_name, exist_ok=True)
-
-if use_elevenlabs:
-    # Fetch voices from ElevenLabs API
-    all_voices_elevenlabs = get_elevenlabs_voices()
-
-    # Specify any voices that you know you want to use for ElevenLabs, if any. USE LOWER CASE. This is pulled from settings.ini
-    specified_voice_names_elevenlabs = [name.strip() for name in config.get('Voice', 'specified_voices_elevenlabs').split(",")]
-
-    # Remove any specified voices that are not in the all_voices list (i.e, invalid voice names)
-    specified_voices_elevenlabs = add_specified_voices([], specified_voice_names_elevenlabs, all_voices_elevenlabs)
-
-    # Fetch remaining voices that have not been specified for ElevenLabs
-    remaining_voices_elevenlabs = [voice for voice in all_voices_elevenlabs if voice not in specified_voices_elevenlabs]
-
-    # Get ChatGPT to choose the Top X best voices based on casting notes for ElevenLabs. X determined by the _actors variables in settings.ini
-    top_voices_elevenlabs = []
-    if elevenlabs_actors > 0:
-        top_voices_elevenlabs = pick_best_voices_elevenlabs(remaining_voices_elevenlabs, casting_note, num_suggestions=elevenlabs_actors)
-
-    # Combine manually specified voices and top voices for ElevenLabs
-    final_voices_elevenlabs = specified_voices_elevenlabs + top_voices_elevenlabs
-
-    # Print final voice picks for ElevenLabs
-    print("Final voice picks for ElevenLabs:")
-    for i, voice in enumerate(final_voices_elevenlabs):
-        print(f"{i+1}. Name: {voice['name']}, Gender: {voice['labels'].get('gender', 'N/A')}, Accent: {voice['labels'].get('accent', 'N/A')}, Voice ID: {voice['voice_id']}, Preview URL: {voice['preview_url']}, Description: {voice['labels'].get('description', 'N/A')}, Use Case: {voice['labels'].get('use case', 'N/A')}")
-
-    # Generate voices for ElevenLabs
-    print(listvoicesonly)
-    if not listvoicesonly:
-        print("i'm trying for elevenlabs")
-        generate_voices_for_elevenlabs(final_voices_elevenlabs, lines, settings_combinations, dir_name)
-
-
-if use_playht:
-    # Fetch voices from Play.ht API
-    all_voices_playht = get_playht_voices()
-
-    # Specify any voices that you know you want to use for Play.ht. USE LOWER CASE. This is pulled from settings.ini
-    specified_voice_names_playht = [name.strip() for name in config.get('Voice', 'specified_voices_playht').split(",")]
-
-    # Remove any specified voices that are not in the all_voices list (i.e, invalid voice names
-    specified_voices_playht = add_specified_voices([], specified_voice_names_playht, all_voices_playht)
-
-    # Fetch remaining voices that have not been specified for Play.ht
-    remaining_voices_playht = [voice for voice in all_voices_playht if voice not in specified_voices_playht]
-
-    # Get ChatGPT to choose the Top X best voices based on casting notes for Play.ht. X determined by the _actors variables in settings.ini
-    top_voices_playht = []
-    if playht_actors > 0:
-        top_voices_playht = pick_best_voices_playht(remaining_voices_playht, casting_note, num_suggestions=playht_actors)
-
-    # Combine manually specified voices and top voices for Play.ht
-    final_voices_playht = specified_voices_playht + top_voices_playht
-
-    # Print final voice picks for Play.ht
-    print("Final voice picks for Play.ht:")
-    for i, voice in enumerate(final_voices_playht):
-        print(f"{i+1}. Name: {voice['name']}, Gender: {voice['gender']}, Language: {voice['language']}")
-
-    # Generate voice lines for the selected Play.ht voices
-    if not listvoicesonly:
-        generate_voices_for_playht(final_voices_playht, lines, dir_name, 10)
+            to_generate.append(job)
+        return to_generate
+
+    # All the jobs are batched up front but only claimed batch by batch as they are submitted, so workers sharing
+    # the directory split them, and the jobs other workers hold are not waited for until this worker's own are done
+    jobs = uncached(select_jobs(manifest, plan_playht_jobs(final_voices, lines, dir_name), claims=claims.unleased(), plan=False))
+    progress = Progress("Play.ht", len(jobs))
+    busy = run_playht_jobs(jobs, max_attempts, concurrency, postprocessor, manifest, progress, claims, provider)
+    if busy:
+        run_playht_jobs(uncached(claim_busy_jobs(manifest, busy, claims, progress)), max_attempts, concurrency, postprocessor, manifest, progress, claims, provider)
+    progress.close()
+    limiter = get_limiter('playht')
+    if limiter.exhausted:
+        print(f"Play.ht character budget of {limiter.max_characters} reached after {limiter.characters_used} characters, the remaining lines were not submitted")
+    elif get_credentials('playht').exhausted:
+        print("Every Play.ht key is out of quota, the remaining lines were not submitted")
+    elif get_credentials('playht').rejecting:
+        print(f"Every Play.ht key is out of rotation ({get_credentials('playht').rejections()}), the remaining lines were not submitted")
+    print(f"Manifest for {dir_name}: {manifest.summary()}")
+
+
+def load_lines():
+    # Stream the voice lines from the lines file (CSV, TSV or JSONL), optionally filtered by id prefix and row range
+    lines_file = config.get('Settings', 'lines_file')
+    line_start, line_stop = parse_line_range(config.get('Settings', 'line_range', fallback=''))
+    return LineScript(lines_file, id_prefix=config.get('Settings', 'line_id_prefix', fallback='').strip() or None, start=line_start, stop=line_stop)
+
+
+def specified_voice_names(provider):
+    # Specify any voices that you know you want to use, if any. USE LOWER CASE. This is pulled from settings.ini
+    return [name.strip() for name in config.get('Voice', f'specified_voices_{provider}').split(",") if name.strip()]
+
+
+class Provider(ABC):
+    """
+    One text-to-speech API: its voice catalog, how its voices are described for casting, how its jobs are
+    planned and how they are generated. The commands only go through this interface, so every enabled provider
+    can be cast, planned and generated the same way, side by side. generate() is the extension point for
+    generation: each provider runs its own scheduler there, since ElevenLabs streams the audio back from one
+    request per line while Play.ht converts batches of lines that are polled and then downloaded.
+    """
+
+    name = None   # Key of the provider in settings.ini, the budgets and the HTTP sessions
+    label = None  # Name shown in the output
+    extension = None  # Extension of the generated files in the synthesis cache
+
+    def __init__(self):
+        # Each provider has its own limit on parallel requests, since they run at the same time
+        self.concurrency = PROVIDER_CONCURRENCY[self.name]
+
+    # With cached_only the catalog and cast come from the local caches alone, for planning without calling any API
+    @abstractmethod
+    def catalog(self, refresh=None, cached_only=False):
+        pass
+
+    # One line describing a voice, for list-voices
+    @abstractmethod
+    def describe(self, voice):
+        pass
+
+    # The full description printed for a cast voice
+    def describe_cast(self, voice):
+        return self.describe(voice)
+
+    @abstractmethod
+    def pick(self, voices, num_suggestions, refresh=None, cached_only=False):
+        pass
+
+    def actors(self):
+        # Number of actors to cast from ChatGPT's suggestions in addition to the specified voices
+        return config.getint('Settings', f'{self.name}_actors')
+
+    def cast(self, refresh_catalog=None, refresh_casting=None, cached_only=False):
+        all_voices = self.catalog(refresh=refresh_catalog, cached_only=cached_only)
+
+        # Remove any specified voices that are not in the all_voices list (i.e, invalid voice names)
+        specified_voices = add_specified_voices([], specified_voice_names(self.name), all_voices)
+
+        # Fetch remaining voices that have not been specified
+        remaining_voices = [voice for voice in all_voices if voice not in specified_voices]
+
+        # Get ChatGPT to choose the Top X best voices based on casting notes. X determined by the _actors variables in settings.ini
+        top_voices = []
+        if self.actors() > 0:
+            top_voices = self.pick(remaining_voices, self.actors(), refresh=refresh_casting, cached_only=cached_only)
+
+        # Combine manually specified voices and top voices
+        final_voices = specified_voices + top_voices
+
+        print(f"Final voice picks for {self.label}:")
+        for i, voice in enumerate(final_voices):
+            print(f"{i+1}. {self.describe_cast(voice)}")
+        return final_voices
+
+    @abstractmethod
+    def plan_jobs(self, final_voices, lines, dir_name):
+        pass
+
+    @abstractmethod
+    def cache_key(self, job):
+        pass
+
+    # Number of API requests needed for these jobs
+    def count_requests(self, jobs):
+        return len(jobs)
+
+    # Run the whole pipeline for the cast voices and every line, recording each job in the manifest
+    @abstractmethod
+    def generate(self, final_voices, lines, dir_name, manifest=None, postprocessor=None, claims=None):
+        pass
+
+    def print_stats(self):
+        print_connection_stats(self.label, get_session(self.name, self.concurrency))
+        get_credentials(self.name).print_stats(self.label)
+
+
+class ElevenLabsProvider(Provider):
+    # Audio is synthesized and streamed back by a single request per job, scheduled by generate_voices_for_elevenlabs
+
+    name = 'elevenlabs'
+    label = 'ElevenLabs'
+    extension = '.wav'
+
+    def catalog(self, refresh=None, cached_only=False):
+        return get_elevenlabs_voices(refresh=refresh, cached_only=cached_only)
+
+    def describe(self, voice):
+        return f"{voice['name']}, Gender: {voice['labels'].get('gender', 'N/A')}, Accent: {voice['labels'].get('accent', 'N/A')}, Voice ID: {voice['voice_id']}"
+
+    def describe_cast(self, voice):
+        return f"Name: {voice['name']}, Gender: {voice['labels'].get('gender', 'N/A')}, Accent: {voice['labels'].get('accent', 'N/A')}, Voice ID: {voice['voice_id']}, Preview URL: {voice['preview_url']}, Description: {voice['labels'].get('description', 'N/A')}, Use Case: {voice['labels'].get('use case', 'N/A')}"
+
+    def pick(self, voices, num_suggestions, refresh=None, cached_only=False):
+        return pick_best_voices_elevenlabs(voices, casting_note, num_suggestions=num_suggestions, refresh=refresh, cached_only=cached_only)
+
+    def plan_jobs(self, final_voices, lines, dir_name):
+        return plan_elevenlabs_jobs(final_voices, lines, settings_combinations, dir_name)
+
+    def cache_key(self, job):
+        return synthesis_key('elevenlabs', job['voice_id'], ELEVENLABS_MODEL_ID, job['line_text'], job['stability'], job['similarity_boost'], job['variant_index'])
+
+    # Generate the audio with the best key that has the voice and stream it to the job's file
+    def synthesize(self, job):
+        return with_credential('elevenlabs', job['voice_id'], len(job['line_text']), lambda credential: generate_audio_elevenlabs(
+            text=job['line_text'], voice_id=job['voice_id'], stability=job['stability'], similarity_boost=job['similarity_boost'], filename=job['filename'], credential=credential))
+
+    def generate(self, final_voices, lines, dir_name, manifest=None, postprocessor=None, claims=None):
+        fetch_elevenlabs_quotas()
+        keep = None
+        if ADAPTIVE_SWEEP and len(settings_combinations) > 1:
+            keep = set(sweep_elevenlabs_settings(final_voices, lines, settings_combinations, dir_name, postprocessor, manifest, claims, self))
+        generate_voices_for_elevenlabs(final_voices, lines, settings_combinations, dir_name, self.concurrency, postprocessor, keep, manifest, claims, self)
+
+
+class PlayHTProvider(Provider):
+    # Lines are submitted for conversion, polled until they are ready and then downloaded, scheduled by run_playht_jobs
+
+    name = 'playht'
+    label = 'Play.ht'
+    extension = '.mp3'
+
+    def catalog(self, refresh=None, cached_only=False):
+        return get_playht_voices(refresh=refresh, cached_only=cached_only)
+
+    def describe(self, voice):
+        return f"{voice['name']}, Gender: {voice['gender']}, Language: {voice['language']}"
+
+    def describe_cast(self, voice):
+        return f"Name: {self.describe(voice)}"
+
+    def pick(self, voices, num_suggestions, refresh=None, cached_only=False):
+        return pick_best_voices_playht(voices, casting_note, num_suggestions=num_suggestions, refresh=refresh, cached_only=cached_only)
+
+    def plan_jobs(self, final_voices, lines, dir_name):
+        return plan_playht_jobs(final_voices, lines, dir_name)
+
+    def cache_key(self, job):
+        return playht_synthesis_key(job)
+
+    def count_requests(self, jobs):
+        return len(plan_playht_batches(jobs))
+
+    # Submit a batch of lines for conversion and return its transcription ID
+    def synthesize(self, batch):
+        return submit_playht_batch(batch)
+
+    # The audio URLs of the batch once it is converted, none while it is still being converted
+    def poll(self, batch):
+        return playht_audio_urls(poll_playht_job(batch['transcription_id'], batch['credential']))
+
+    # Save the audio of a converted batch and return the jobs saved
+    def download(self, batch, audio_urls):
+        return download_playht_batch(batch, audio_urls)
+
+    def generate(self, final_voices, lines, dir_name, manifest=None, postprocessor=None, claims=None):
+        generate_voices_for_playht(final_voices, lines, dir_name, 10, self.concurrency, postprocessor, manifest, claims, self)
+
+
+PROVIDERS = {provider.name: provider for provider in (ElevenLabsProvider, PlayHTProvider)}
+
+
+def selected_providers(args):
+    if getattr(args, 'provider', None) and args.provider != 'all':
+        names = [args.provider]
+    else:
+        names = [name for name, enabled in (('elevenlabs', use_elevenlabs), ('playht', use_playht)) if enabled]
+    return [PROVIDERS[name]() for name in names]
+
+
+def command_list_voices(args):
+    # Print the whole catalog of each provider; served from the local catalog cache when it is fresh
+    for provider in selected_providers(args):
+        for voice in provider.catalog(refresh=args.refresh_catalog or None):
+            print(provider.describe(voice))
+
+
+def command_cast(args, cached_only=False):
+    if args.clear_casting_cache and not cached_only:
+        clear_casting_cache(CACHE_DIR)
+        print("Cleared the casting cache")
+    cast = {}
+    for provider in selected_providers(args):
+        if cached_only:
+            cast[provider] = provider.cast(cached_only=True)
+        else:
+            cast[provider] = provider.cast(args.refresh_catalog or None, args.refresh_casting or None)
+    return cast
+
+
+def command_generate(args):
+    # A dry run casts from the cached catalogs and cast only, so it never calls an API
+    cast = command_cast(args, cached_only=args.dry_run)
+    lines = load_lines()
+    dir_name = config.get('System', 'directory_name')
+    shard = args.shard or SHARD
+
+    if args.dry_run:
+        # Plan the whole job matrix (or this worker's shard of it) without calling any generation API
+        claims = JobClaims(shard)
+        manifest = JobManifest(dir_name, read_only=True) if os.path.exists(dir_name) else None
+        audio_cache = get_audio_cache()
+        is_done = lambda job: manifest is not None and manifest.is_done(job_key(job))
+        # Use the timings of earlier runs in this directory when there are any
+        expected_latency = (manifest.average_latency() if manifest is not None else None) or EXPECTED_LATENCY
+        for provider, final_voices in cast.items():
+            is_cached = lambda job: audio_cache is not None and audio_cache.contains(provider.cache_key(job), provider.extension)
+            chars_per_minute, max_characters = BUDGET[provider.name]
+            report = plan_report(filter(claims.in_shard, provider.plan_jobs(final_voices, lines, dir_name)), is_done, is_cached, provider.concurrency, expected_latency,
+                                 chars_per_minute, max_characters, provider.count_requests)
+            print_plan(provider.name, report, max_characters)
+        return
+
+    # Ensure the directory exists
+    os.makedirs(dir_name, exist_ok=True)
+    # With leases, workers sharing the output directory claim each job there before generating it
+    leases = LeaseDirectory(os.path.join(dir_name, LEASE_DIR_NAME), LEASE_TTL, args.worker_id or WORKER_ID) if args.leases or LEASES else None
+    claims = JobClaims(shard, leases)
+    # One manifest for this worker, shared by the providers running at the same time
+    manifest = JobManifest(dir_name, f"manifest{claims.suffix}.jsonl")
+    postprocessor = None
+    if POSTPROCESS:
+        postprocessor = PostProcessor(os.path.join(dir_name, POSTPROCESS_DIR), TRIM_SILENCE, SILENCE_THRESHOLD_DB, TARGET_DBFS, POSTPROCESS_WORKERS, metrics)
+
+    # Every provider runs its own pipeline at the same time, each within its own concurrency limit,
+    # so Play.ht conversions don't wait for the ElevenLabs jobs to finish
+    with ThreadPoolExecutor(max_workers=max(1, len(cast))) as executor:
+        futures = [executor.submit(provider.generate, final_voices, lines, dir_name, manifest, postprocessor, claims) for provider, final_voices in cast.items()]
+        for future in as_completed(futures):
+            future.result()
+
+    claims.close()
+    for provider in cast:
+        provider.print_stats()
+    if get_audio_cache() is not None:
+        get_audio_cache().print_stats("Audio")
+    if postprocessor is not None:
+        # Most takes were processed while the rest were still generating; wait for the last few
+        postprocessor.close()
+    metrics.export(dir_name, claims.suffix)
+
+
+def command_clone(args):
+    # pydub is only needed for cloning, so CreateVoice is imported here
+    from CreateVoice import create_voice
+    # Decoded recordings are kept next to the other caches so cloning the same takes again skips decoding.
+    # The voice is cloned on the account of the first ElevenLabs key.
+    create_voice(args.directory, args.name, args.description, args.labels, url=ELEVENLABS_URL_ADD_VOICE, api_key=ELEVENLABS_API_KEY, cache_dir=os.path.join(CACHE_DIR, 'pcm'))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Cast AI voice actors and generate voice lines with ElevenLabs and Play.ht.")
+    parser.add_argument('--settings', default='settings.ini', help="Settings file to use (default: settings.ini)")
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_voices = subparsers.add_parser('list-voices', help="Print the voice catalog of each provider")
+    list_voices.add_argument('--provider', choices=['elevenlabs', 'playht', 'all'], help="Only this provider (default: the ones enabled in settings.ini)")
+    list_voices.add_argument('--refresh-catalog', action='store_true', help="Fetch the catalog from the API even if the cached one is fresh")
+
+    for name, help_text in (('cast', "Pick voices for the casting note and print them"), ('generate', "Cast voices and generate every line")):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument('--provider', choices=['elevenlabs', 'playht', 'all'], help="Only this provider (default: the ones enabled in settings.ini)")
+        command.add_argument('--refresh-catalog', action='store_true', help="Fetch the catalogs from the APIs even if the cached ones are fresh")
+        command.add_argument('--refresh-casting', action='store_true', help="Ask ChatGPT again instead of reusing the cached cast")
+        command.add_argument('--clear-casting-cache', action='store_true', help="Forget every cached casting decision first")
+        if name == 'generate':
+            command.add_argument('--dry-run', action='store_true', help="Show how many jobs would run, from the cached catalogs and cast, without calling any API")
+            command.add_argument('--shard', type=parse_shard, metavar='I/N', help="Only generate the I-th of N equal shards of the jobs (default: [Sharding] shard)")
+            command.add_argument('--leases', action='store_true', help="Claim each job in the output directory first, so workers sharing it never generate a job twice")
+            command.add_argument('--worker-id', type=parse_worker_id, help="Name of this worker's manifest and metrics files with --leases (default: [Sharding] worker_id, or the host name)")
+
+    clone = subparsers.add_parser('clone', help="Create an ElevenLabs voice from a directory of recordings")
+    clone.add_argument('directory', help="Directory of .mp3/.wav recordings")
+    clone.add_argument('--name', required=True, help="Name of the new voice")
+    clone.add_argument('--description', default='', help="Description of the new voice")
+    clone.add_argument('--labels', default='{}', help='Labels as a JSON object, e.g. \'{"accent": "American"}\'')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    load_settings(args.settings)
+
+    if args.command is None:
+        # No command: do what settings.ini says, like earlier versions of this script
+        args = parser.parse_args(['--settings', args.settings, 'cast' if listvoicesonly else 'generate'])
+
+    commands = {
+        'list-voices': command_list_voices,
+        'cast': command_cast,
+        'generate': command_generate,
+        'clone': command_clone
+    }
+    commands[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
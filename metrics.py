@@ -0,0 +1,157 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from atomic_file import atomic_write
+
+
+# Nearest-rank percentile: the smallest value with at least `fraction` of the values at or below it
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+class Metrics:
+    """
+    Thread-safe record of every provider call, casting call and file write in a run, grouped by
+    (provider, operation). Exported as a JSON summary and as a Prometheus text file.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.operations = {}
+
+    def record(self, provider, operation, latency, ttfb=None, bytes_transferred=0, retries=0, status=None, error=False):
+        with self.lock:
+            stats = self.operations.setdefault((provider, operation), {
+                'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': [], 'ttfbs': [], 'statuses': {}
+            })
+            stats['count'] += 1
+            stats['errors'] += bool(error)
+            stats['retries'] += retries
+            stats['bytes'] += bytes_transferred
+            stats['latencies'].append(latency)
+            if ttfb is not None:
+                stats['ttfbs'].append(ttfb)
+            if status is not None:
+                stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+
+    # Count the bytes of a streamed body against the call that returned it, once they have been read
+    def add_bytes(self, provider, operation, bytes_transferred):
+        with self.lock:
+            stats = self.operations.get((provider, operation))
+            if stats is not None:
+                stats['bytes'] += bytes_transferred
+
+    def summary(self):
+        with self.lock:
+            operations = []
+            for (provider, operation), stats in sorted(self.operations.items()):
+                latencies = stats['latencies']
+                operations.append({
+                    'provider': provider,
+                    'operation': operation,
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes': stats['bytes'],
+                    'statuses': dict(stats['statuses']),
+                    'latency': {'mean': sum(latencies) / len(latencies) if latencies else 0.0, 'p50': percentile(latencies, 0.5),
+                                'p90': percentile(latencies, 0.9), 'p99': percentile(latencies, 0.99), 'max': max(latencies, default=0.0)},
+                    'ttfb': {'p50': percentile(stats['ttfbs'], 0.5), 'p99': percentile(stats['ttfbs'], 0.99)} if stats['ttfbs'] else None
+                })
+            return {'started': self.started, 'duration': time.time() - self.started, 'operations': operations}
+
+    def prometheus(self):
+        lines = []
+
+        # samples are (name suffix, labels, value); summaries use the _sum and _count suffixes
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+        summary = self.summary()
+        operations = summary['operations']
+
+        def labels(op, **extra):
+            return dict({'provider': op['provider'], 'operation': op['operation']}, **extra)
+
+        metric('voicegen_requests_total', 'counter', "Calls made, by response status",
+               [('', labels(op, status=status), count) for op in operations for status, count in op['statuses'].items()]
+               + [('', labels(op), op['count']) for op in operations if not op['statuses']])
+        metric('voicegen_errors_total', 'counter', "Calls that failed", [('', labels(op), op['errors']) for op in operations])
+        metric('voicegen_retries_total', 'counter', "Retries after 429/5xx responses or connection errors", [('', labels(op), op['retries']) for op in operations])
+        metric('voicegen_bytes_total', 'counter', "Bytes received or written", [('', labels(op), op['bytes']) for op in operations])
+        latency_samples = []
+        for op in operations:
+            latency_samples.extend(('', labels(op, quantile=quantile), op['latency'][key]) for quantile, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99')))
+            latency_samples.append(('_sum', labels(op), op['latency']['mean'] * op['count']))
+            latency_samples.append(('_count', labels(op), op['count']))
+        metric('voicegen_latency_seconds', 'summary', "Call latency", latency_samples)
+        metric('voicegen_ttfb_seconds', 'summary', "Time to first byte of the response",
+               [('', labels(op, quantile=quantile), op['ttfb'][key]) for op in operations if op['ttfb'] for quantile, key in (('0.5', 'p50'), ('0.99', 'p99'))])
+        metric('voicegen_run_duration_seconds', 'gauge', "Seconds since the run started", [('', {}, round(summary['duration'], 3))])
+        return '\n'.join(lines) + '\n'
+
+    # Write metrics.json and metrics.prom (with the suffix before the extension) into the directory, replacing them atomically
+    def export(self, directory, suffix=''):
+        for name, content in ((f'metrics{suffix}.json', json.dumps(self.summary(), indent=2)), (f'metrics{suffix}.prom', self.prometheus())):
+            with atomic_write(os.path.join(directory, name), encoding='utf-8') as f:
+                f.write(content)
+        print(f"Wrote metrics{suffix}.json and metrics{suffix}.prom to {directory}")
+
+
+class Progress:
+    """
+    Live progress line with throughput and ETA, written to stderr so it doesn't mix with the log on stdout.
+    On a terminal the line is redrawn in place; otherwise a line is printed every `interval` seconds.
+    """
+
+    def __init__(self, name, total, interval=10.0):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.last_shown = 0.0
+        self.tty = sys.stderr.isatty()
+        self.interval = 0.5 if self.tty else interval
+        self.lock = threading.Lock()
+
+    # Jobs that turned out to be done already, or were left for a later run, no longer count towards the total
+    def skip(self, count=1):
+        with self.lock:
+            self.total -= count
+
+    def update(self, bytes_written=0, failed=False):
+        with self.lock:
+            self.done += 1
+            self.failed += failed
+            self.bytes += bytes_written
+            now = time.monotonic()
+            if now - self.last_shown >= self.interval or self.done == self.total:
+                self.last_shown = now
+                self.show(now)
+
+    def show(self, now):
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate and self.total else 0
+        line = (f"{self.name}: {self.done}/{self.total} jobs ({self.failed} failed), {rate:.1f} jobs/s, "
+                f"{self.bytes / (1024 * 1024):.1f} MB, ETA {time.strftime('%H:%M:%S', time.gmtime(remaining))}")
+        sys.stderr.write(f"\r{line}\033[K" if self.tty else f"{line}\n")
+        sys.stderr.flush()
+
+    def close(self):
+        if self.tty and self.done:
+            sys.stderr.write("\n")
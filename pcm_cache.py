@@ -0,0 +1,70 @@
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from atomic_file import atomic_write
+
+
+# Every recording is decoded to the same raw format so the clips can be packed together as they are
+PCM_CHANNELS = 1
+PCM_SAMPLE_WIDTH = 2
+PCM_FRAME_RATE = 44100
+
+
+# Key a decoded recording on the file it came from; editing or replacing the file changes its mtime or size
+def pcm_key(path, channels=PCM_CHANNELS, sample_width=PCM_SAMPLE_WIDTH, frame_rate=PCM_FRAME_RATE):
+    stat = os.stat(path)
+    payload = json.dumps([os.path.abspath(path), stat.st_mtime_ns, stat.st_size, channels, sample_width, frame_rate])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def pcm_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.pcm")
+
+
+# Decode one recording to raw PCM in the cache, unless an earlier run already did. Returns the path of the raw file.
+# Runs in a worker process, so pydub (and the ffmpeg process it starts) is only loaded there.
+def decode_to_cache(path, cache_dir, channels=PCM_CHANNELS, sample_width=PCM_SAMPLE_WIDTH, frame_rate=PCM_FRAME_RATE):
+    cached_path = pcm_path(cache_dir, pcm_key(path, channels, sample_width, frame_rate))
+    if os.path.exists(cached_path):
+        return cached_path
+
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path).set_channels(channels).set_sample_width(sample_width).set_frame_rate(frame_rate)
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    with atomic_write(cached_path, 'wb') as f:
+        f.write(audio.raw_data)
+    return cached_path
+
+
+# Memory-map a cached raw file. Empty files can't be mapped, so they come back as empty bytes.
+def open_pcm(cached_path):
+    with open(cached_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def decode_all(paths, cache_dir, workers=None):
+    """
+    Decode the recordings on a process pool and yield (path, mapped PCM) in the order of `paths`.
+    Recordings decoded by an earlier run are read straight from the cache without starting a decoder.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pending = [path for path in paths if not os.path.exists(pcm_path(cache_dir, pcm_key(path)))]
+    if not pending:
+        for path in paths:
+            yield path, open_pcm(pcm_path(cache_dir, pcm_key(path)))
+        return
+
+    print(f"Decoding {len(pending)} of {len(paths)} recordings, the rest are in the PCM cache")
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # Files are decoded in parallel but handed over in order, as soon as each one and those before it are ready
+        for path, cached_path in zip(paths, executor.map(decode_to_cache, paths, [cache_dir] * len(paths))):
+            yield path, open_pcm(cached_path)
+    finally:
+        # The caller may stop early once it has enough audio; don't decode the rest
+        executor.shutdown(cancel_futures=True)
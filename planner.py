@@ -0,0 +1,84 @@
+import math
+import threading
+import time
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class CharacterLimiter:
+    """
+    Token bucket over characters sent to a provider. acquire() waits until the characters-per-minute
+    rate allows the request and returns False once the run's total character budget would be exceeded,
+    so callers can stop cleanly instead of being cut off by the provider's quota.
+    A limit of 0 means unlimited.
+    """
+
+    def __init__(self, chars_per_minute=0, max_characters=0):
+        self.rate = chars_per_minute / 60.0
+        # Allow a burst of up to one minute of characters
+        self.capacity = chars_per_minute
+        self.tokens = chars_per_minute
+        self.max_characters = max_characters
+        self.characters_used = 0
+        self.exhausted = False
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, characters):
+        with self.lock:
+            if self.max_characters and self.characters_used + characters > self.max_characters:
+                self.exhausted = True
+                return False
+            self.characters_used += characters
+            if not self.rate:
+                return True
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Take the characters now, going into debt if needed, and sleep off the debt outside the lock.
+            # A request longer than the bucket still goes through after waiting for a full bucket.
+            self.tokens -= characters
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return True
+
+
+# Walk the whole job matrix and work out what a run would cost without calling any API
+def plan_report(jobs, is_done, is_cached, concurrency, expected_latency, chars_per_minute=0, max_characters=0, count_requests=len):
+    report = {'jobs': 0, 'characters': 0, 'done': 0, 'cached': 0, 'to_generate': 0, 'characters_to_send': 0}
+    to_generate = []
+    for job in jobs:
+        characters = len(job['line_text'])
+        report['jobs'] += 1
+        report['characters'] += characters
+        if is_done(job):
+            report['done'] += 1
+        elif is_cached(job):
+            report['cached'] += 1
+        else:
+            to_generate.append(job)
+            report['characters_to_send'] += characters
+    report['to_generate'] = len(to_generate)
+    report['requests'] = count_requests(to_generate)
+
+    # Requests run `concurrency` at a time; a characters-per-minute limit can make the run slower still
+    wall_time = math.ceil(report['requests'] / max(concurrency, 1)) * expected_latency
+    if chars_per_minute:
+        wall_time = max(wall_time, report['characters_to_send'] / chars_per_minute * 60)
+    report['expected_wall_time'] = wall_time
+    report['within_budget'] = not max_characters or report['characters_to_send'] <= max_characters
+    return report
+
+
+def print_plan(name, report, max_characters=0):
+    print(f"Plan for {name}:")
+    print(f"  {report['jobs']} jobs, {report['characters']} characters in total")
+    print(f"  {report['done']} already done, {report['cached']} served from the synthesis cache")
+    print(f"  {report['to_generate']} to generate in {report['requests']} requests, {report['characters_to_send']} characters to send")
+    print(f"  Expected wall time: {time.strftime('%H:%M:%S', time.gmtime(report['expected_wall_time']))}")
+    if max_characters:
+        status = "within" if report['within_budget'] else "OVER"
+        print(f"  Character budget: {report['characters_to_send']} of {max_characters} ({status} budget)")
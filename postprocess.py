@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import wave
+
+from atomic_file import atomic_path
+
+
+def read_audio(path):
+    # Returns the samples as float32 in [-1, 1] with shape (frames, channels), and the frame rate.
+    # ElevenLabs audio is MPEG even when saved as .wav, so the file's header decides how it is read, not its name.
+    import numpy as np
+
+    with open(path, 'rb') as f:
+        is_wav = f.read(4) == b'RIFF'
+    if is_wav:
+        with wave.open(path, 'rb') as f:
+            if f.getsampwidth() == 2:
+                samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').reshape(-1, f.getnchannels())
+                return samples.astype(np.float32) / 32768, f.getframerate()
+
+    # Compressed audio (and unusual sample widths) go through pydub and ffmpeg
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path, format='wav' if is_wav else 'mp3').set_sample_width(2)
+    samples = np.frombuffer(audio.raw_data, dtype='<i2').reshape(-1, audio.channels)
+    return samples.astype(np.float32) / 32768, audio.frame_rate
+
+
+def trim_silence(samples, frame_rate, threshold_db, window_ms=10, padding_ms=50):
+    # Cut leading and trailing windows whose RMS is below the threshold, keeping a little padding around the speech
+    import numpy as np
+
+    window = max(1, frame_rate * window_ms // 1000)
+    num_windows = len(samples) // window
+    if num_windows == 0:
+        return samples
+    mono = samples[:num_windows * window].mean(axis=1).reshape(num_windows, window)
+    rms_db = 10 * np.log10(np.mean(mono ** 2, axis=1) + 1e-12)
+    loud = np.flatnonzero(rms_db > threshold_db)
+    if len(loud) == 0:
+        return samples[:0]
+    padding = frame_rate * padding_ms // 1000
+    start = max(0, loud[0] * window - padding)
+    stop = min(len(samples), (loud[-1] + 1) * window + padding)
+    return samples[start:stop]
+
+
+def normalize_loudness(samples, target_dbfs, peak_dbfs=-1.0):
+    # Scale the take to the target RMS level, but never so far that a peak goes over peak_dbfs
+    import numpy as np
+
+    if len(samples) == 0:
+        return samples, 0.0
+    rms = np.sqrt(np.mean(samples.astype(np.float64) ** 2))
+    peak = np.max(np.abs(samples))
+    if rms == 0 or peak == 0:
+        return samples, 0.0
+    gain_db = min(target_dbfs - 20 * np.log10(rms), peak_dbfs - 20 * np.log10(peak))
+    return samples * np.float32(10 ** (gain_db / 20)), float(gain_db)
+
+
+def write_wav(path, samples, frame_rate):
+    import numpy as np
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    with atomic_path(path) as temp_path:
+        with wave.open(temp_path, 'wb') as f:
+            f.setnchannels(pcm.shape[1])
+            f.setsampwidth(2)
+            f.setframerate(frame_rate)
+            f.writeframes(pcm.tobytes())
+
+
+# Runs in a worker process. Returns the seconds spent, the bytes written and the seconds of silence trimmed.
+def process_take(path, output_path, trim, silence_threshold_db, target_dbfs):
+    started = time.perf_counter()
+    samples, frame_rate = read_audio(path)
+    duration = len(samples)
+    if trim:
+        samples = trim_silence(samples, frame_rate, silence_threshold_db)
+    if target_dbfs is not None:
+        samples, _ = normalize_loudness(samples, target_dbfs)
+    write_wav(output_path, samples, frame_rate)
+    return time.perf_counter() - started, os.path.getsize(output_path), (duration - len(samples)) / frame_rate
+
+
+class PostProcessor:
+    """
+    Converts generated takes to real 16-bit WAV files, trims their silence and normalizes their loudness
+    on a process pool. Takes are submitted as soon as they are saved, so processing overlaps generation.
+    The processed copies go to output_dir; the generated files are left untouched.
+    """
+
+    def __init__(self, output_dir, trim=True, silence_threshold_db=-50.0, target_dbfs=-20.0, workers=None, metrics=None):
+        self.output_dir = output_dir
+        self.options = (trim, silence_threshold_db, target_dbfs)
+        self.metrics = metrics
+        self.executor = None
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.trimmed_seconds = 0.0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def output_path(self, filename):
+        return os.path.join(self.output_dir, os.path.splitext(os.path.basename(filename))[0] + '.wav')
+
+    def submit(self, filename):
+        output_path = self.output_path(filename)
+        # Takes processed by an earlier run are only done again if the take was regenerated since
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(filename):
+            with self.lock:
+                self.skipped += 1
+            return
+        with self.lock:
+            if self.executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # The pool is started on the first take, so runs with nothing to process don't pay for it.
+                # Workers are spawned rather than forked because the generation threads are already running.
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            future = self.executor.submit(process_take, filename, output_path, *self.options)
+        future.add_done_callback(lambda future: self.finish(future, filename))
+
+    def finish(self, future, filename):
+        try:
+            seconds, bytes_written, trimmed = future.result()
+        except Exception as e:
+            print(f"Failed to post-process {filename}. Error: {str(e)}")
+            with self.lock:
+                self.failed += 1
+            if self.metrics is not None:
+                self.metrics.record('local', 'postprocess', 0.0, error=True)
+            return
+        with self.lock:
+            self.processed += 1
+            self.trimmed_seconds += trimmed
+        if self.metrics is not None:
+            self.metrics.record('local', 'postprocess', seconds, bytes_transferred=bytes_written)
+
+    # Wait for the takes still being processed and print what was done
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.processed or self.skipped or self.failed:
+            print(f"Post-processed {self.processed} takes into {self.output_dir} ({self.skipped} already done, {self.failed} failed), "
+                  f"trimmed {self.trimmed_seconds:.1f}s of silence")
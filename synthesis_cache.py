@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from atomic_file import atomic_path
+
+
+# Key a synthesis request on everything that changes the audio the API sends back
+def synthesis_key(provider, voice_id, model_id, text, stability=None, similarity_boost=None, variant=1):
+    payload = json.dumps([provider, voice_id, model_id, text, stability, similarity_boost, variant])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Try a hard link first so a cache hit costs no disk space, and fall back to a copy across filesystems
+def link_or_copy(source, destination):
+    with atomic_path(destination) as temp_path:
+        os.remove(temp_path)
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+
+
+class SynthesisCache:
+    """
+    Content-addressed store of generated audio shared across runs and output directories.
+    Entries are evicted least recently used first once the store grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Scan the store once; after that the total is kept up to date as entries come and go
+        self.total_bytes = sum(os.path.getsize(path) for path in self.entries())
+
+    def entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.part'):
+                    yield os.path.join(root, name)
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key[:2], f"{key}{extension}")
+
+    def contains(self, key, extension):
+        return os.path.exists(self.path(key, extension))
+
+    # Put the cached audio for `key` at `filename`. Returns False if the audio has not been generated before.
+    def fetch(self, key, filename):
+        path = self.path(key, os.path.splitext(filename)[1])
+        try:
+            link_or_copy(path, filename)
+            # Touch the entry so it counts as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+        return True
+
+    # Add a freshly generated file to the store
+    def store(self, key, filename):
+        path = self.path(key, os.path.splitext(filename)[1])
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(filename, path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(path)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Oldest modification time first; fetch() touches entries, so this is least recently used first
+        entries = sorted(self.entries(), key=os.path.getmtime)
+        # Leave some headroom so we don't rescan the store on every store() once it is full
+        target = self.max_bytes * 0.9
+        for path in entries:
+            if self.total_bytes <= target:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.total_bytes -= size
+
+    def print_stats(self, name):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return
+        print(f"{name} synthesis cache: {self.hits} hits, {self.misses} misses ({100 * self.hits / lookups:.0f}% hit rate), {self.total_bytes / (1024 * 1024):.1f} MB stored")
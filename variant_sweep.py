@@ -0,0 +1,70 @@
+from postprocess import read_audio
+
+
+ENVELOPE_BINS = 32
+
+
+def audio_features(path, silence_db=-50.0, window_ms=10):
+    # Cheap features of one take: its length, loudness, share of clipped samples, share of silent
+    # windows, and a coarse loudness envelope to tell apart takes that sound different
+    import numpy as np
+
+    samples, frame_rate = read_audio(path)
+    mono = samples.mean(axis=1)
+    window = max(1, frame_rate * window_ms // 1000)
+    num_windows = len(mono) // window
+    if num_windows == 0:
+        return {'duration': len(mono) / frame_rate, 'rms_db': -120.0, 'clipping': 0.0, 'silence_ratio': 1.0, 'envelope': np.zeros(ENVELOPE_BINS)}
+    window_rms = np.sqrt(np.mean(mono[:num_windows * window].reshape(num_windows, window) ** 2, axis=1))
+    window_db = 20 * np.log10(window_rms + 1e-6)
+    # Resample the per-window loudness to a fixed number of bins so takes of different lengths compare
+    envelope = np.interp(np.linspace(0, num_windows - 1, ENVELOPE_BINS), np.arange(num_windows), window_rms)
+    return {
+        'duration': len(mono) / frame_rate,
+        'rms_db': float(20 * np.log10(np.sqrt(np.mean(mono.astype(np.float64) ** 2)) + 1e-6)),
+        'clipping': float(np.mean(np.abs(samples) >= 0.999)),
+        'silence_ratio': float(np.mean(window_db < silence_db)),
+        'envelope': envelope / (envelope.max() or 1.0)
+    }
+
+
+def is_broken(features, min_duration=0.3, max_silence_ratio=0.8, max_clipping=0.01):
+    return features['duration'] < min_duration or features['silence_ratio'] > max_silence_ratio or features['clipping'] > max_clipping
+
+
+# How different two takes of the same line are: envelope shape, relative length and loudness, roughly 0 to 1
+def take_distance(a, b):
+    import numpy as np
+
+    envelope = np.sqrt(np.mean((a['envelope'] - b['envelope']) ** 2))
+    duration = abs(a['duration'] - b['duration']) / max(a['duration'], b['duration'], 1e-6)
+    loudness = min(1.0, abs(a['rms_db'] - b['rms_db']) / 20)
+    return float((envelope + duration + loudness) / 3)
+
+
+def prune_settings(settings_combinations, pilot_features, tolerance):
+    """
+    Decide which settings points to keep for the rest of the script from the features of their pilot takes.
+    `pilot_features` maps each settings point to {(voice, line): features}. A point is dropped if most of
+    its pilot takes are broken, or if its takes are within `tolerance` of a point kept before it, in grid
+    order. Points without pilot takes are kept. Returns the kept points and the reason each other point was dropped.
+    """
+    kept = []
+    dropped = {}
+    for point in settings_combinations:
+        takes = pilot_features.get(point)
+        if not takes:
+            kept.append(point)
+            continue
+        if sum(is_broken(features) for features in takes.values()) * 2 > len(takes):
+            dropped[point] = "broken"
+            continue
+        for other in kept:
+            other_takes = pilot_features.get(other) or {}
+            shared = [take for take in takes if take in other_takes]
+            if shared and max(take_distance(takes[take], other_takes[take]) for take in shared) < tolerance:
+                dropped[point] = f"near duplicate of stability {other[0]}, similarity {other[1]}, variant {other[2]}"
+                break
+        else:
+            kept.append(point)
+    return kept, dropped
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from atomic_file import atomic_write
+
+
+def tokenize(text):
+    tokens = re.findall(r"[a-z0-9]+", text.lower())
+    # Cheap plural folding so "accents" in a casting note matches an "accent" label
+    return [token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token for token in tokens]
+
+
+# Build a TF-IDF index with one normalized vector per document
+def build_index(documents):
+    term_counts = [Counter(tokenize(document)) for document in documents]
+    document_frequency = Counter(term for counts in term_counts for term in counts)
+    num_documents = len(documents)
+    idf = {term: math.log((1 + num_documents) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+
+    vectors = []
+    for counts in term_counts:
+        vector = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        vectors.append({term: weight / norm for term, weight in vector.items()})
+    return {'idf': idf, 'vectors': vectors}
+
+
+def index_path(cache_dir, key):
+    return os.path.join(cache_dir, 'index', f"{key}.json")
+
+
+# Return the index for these voice descriptions. With a cache_dir it is stored next to the catalog cache,
+# keyed by a hash of the descriptions, so it is only built the first time a catalog version is seen.
+def get_index(documents, cache_dir=None):
+    key = hashlib.sha256(json.dumps(documents).encode('utf-8')).hexdigest()
+    if cache_dir:
+        try:
+            with open(index_path(cache_dir, key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    index = build_index(documents)
+    if cache_dir:
+        os.makedirs(os.path.dirname(index_path(cache_dir, key)), exist_ok=True)
+        with atomic_write(index_path(cache_dir, key), encoding='utf-8') as f:
+            json.dump(index, f)
+    return index
+
+
+# Score every voice against the query by cosine similarity, best match first.
+# Ties keep catalog order so the ranking is deterministic.
+def rank_voices(voices, query, voice_text, cache_dir=None):
+    index = get_index([voice_text(voice) for voice in voices], cache_dir)
+    query_counts = Counter(term for term in tokenize(query) if term in index['idf'])
+    query_vector = {term: (1 + math.log(count)) * index['idf'][term] for term, count in query_counts.items()}
+    scores = [sum(vector.get(term, 0.0) * weight for term, weight in query_vector.items()) for vector in index['vectors']]
+    return sorted(range(len(voices)), key=lambda i: -scores[i])
+
+
+# Keep only the top `size` voices for the casting note, in their original catalog order,
+# so the casting prompt stays the same size however large the catalog gets
+def shortlist_voices(voices, casting_note, size, voice_text, cache_dir=None):
+    if size <= 0 or len(voices) <= size:
+        return voices
+    keep = set(rank_voices(voices, casting_note, voice_text, cache_dir)[:size])
+    shortlist = [voice for i, voice in enumerate(voices) if i in keep]
+    print(f"Shortlisted {len(shortlist)} of {len(voices)} voices for the casting note")
+    return shortlist